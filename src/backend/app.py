@@ -1,6 +1,7 @@
 # app.py
 import httpx, uvicorn, chromadb, time
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from typing import Union
 import sys
 import os
@@ -10,55 +11,178 @@ import logging
 from router.semanticRouter import create_router
 from backend.modelsPydantic import (
     QueryResponse, QueryRequest, UpdateChannelInfo, UpdateChatHistory, 
-    UpdateGuildInfo, UpdateMemberInfo, UpdateChannelList
+    UpdateGuildInfo, UpdateMemberInfo, UpdateChannelList, RouteBatchRequest
 )
-from services.queryLangchain import fetchGptResponse
+from services.queryLangchain import llm_gateway, retriever_cache, fetchGptResponse, fetchGptResponseStream
 from services.nlpTools import TextProcessor
+from services.semanticCache import SemanticCache
+from services.contextBuilder import build_context, context_sources
+from services.singleFlight import SingleFlight, normalize_query
+from services.reranker import reranker
 from database.crudChroma import CRUD
 from database.modelsChroma import (
-    generate_embedding, ChatHistory, GuildInfo, ChannelInfo, MemberInfoChannel, ChannelList
+    embedding_registry, embedding_cache, generate_embedding, to_documents, ChatHistory, GuildInfo, ChannelInfo, MemberInfoChannel, ChannelList
 )
 from utlis.prompts import PROMPTS
+from utlis.config import (
+    ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_SIZE, ANSWER_CACHE_CHAT_TTL, CONTEXT_TOKEN_BUDGET, LEXICAL_FASTPATH_MAX_TOKENS,
+    RERANK_CANDIDATES
+)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 app = FastAPI()
 crud = CRUD()
-semantic_router = create_router(crud)
+retriever_cache.attach(crud)
+# BM25 terms use the same tokens (lowercased, stop words removed, lemmatized) as the rest of the NLP tools
+crud.enable_lexical_index(TextProcessor().preprocess_text, fastpath_max_tokens=LEXICAL_FASTPATH_MAX_TOKENS)
+answer_cache = SemanticCache(
+    crud,
+    threshold=ANSWER_CACHE_THRESHOLD,
+    ttl=ANSWER_CACHE_TTL,
+    max_entries=ANSWER_CACHE_SIZE,
+    chat_ttl=ANSWER_CACHE_CHAT_TTL
+)
+semantic_router = create_router(crud, answer_cache)
+single_flight = SingleFlight()
+
+@app.on_event("startup")
+async def warm_up_models():
+    # build the embedding backend before the first request needs it
+    await embedding_registry.warm_up()
+    await reranker.warm_up()
+    try:
+        await semantic_router.get_route_index()
+    except Exception as e:
+        # retried on the first routed query
+        logging.error(f"Error with building the route index: {e}")
+
+@app.on_event("shutdown")
+async def close_clients():
+    await llm_gateway.aclose()
+
+@app.get('/stats')
+async def stats():
+    return {
+        "embedding_models": embedding_registry.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "reranker": reranker.stats(),
+        "llm": llm_gateway.get_stats(),
+        "coalescing": single_flight.stats()
+    }
+
+async def channel_context(request: QueryRequest, query_embedding):
+    """Collects the relevant messages and channel info for a channel query, plus their authors as sources"""
+    collection_name = f"chat_history_{request.channel_id}"
+    top_k = RERANK_CANDIDATES if reranker.enabled else 5
+    relevant_docs = await crud.get_data_hybrid(collection_name, request.query, query_embedding, top_k=top_k)
+    relevant_docs = await reranker.rerank(request.query, relevant_docs)
+    channel_info = await crud.get_data_by_id(f"channel_info_{request.guild_id}", [request.channel_id])
+
+    content = build_context(relevant_docs, token_budget=CONTEXT_TOKEN_BUDGET, source_key='author')
+    data = channel_info.get('metadatas')[0] if channel_info and channel_info.get('metadatas') else {}
+
+    logging.info(f"Relevant messages: {content}")
+    logging.info(f"Channel info: {data}")
+
+    # combine the relevant messages and channel info
+    combined_data = {
+        'relevant_messages': content,
+        'channel_info': data
+    }
+    return combined_data, context_sources(relevant_docs, source_key='author')
+
+async def answer_channel_query(request: QueryRequest):
+    query_embedding = await generate_embedding(request.query)
+    collection_name = f"chat_history_{request.channel_id}"
+
+    async def answer_query():
+        combined_data, sources = await channel_context(request, query_embedding)
+        answer = await fetchGptResponse(request.query, PROMPTS['channel_summarizer'], combined_data)
+        return {'answer': answer, 'sources': sources}
+
+    # similar questions asked recently in this channel are answered from the cache
+    return await answer_cache.get_or_compute(collection_name, query_embedding, answer_query)
 
 @app.post('/channel_query') #, response_model=QueryResponse
 async def channel_query(request: QueryRequest):
     try:
-        query_embedding = await generate_embedding(request.query)
-        collection_name = f"chat_history_{request.channel_id}"
-        relevant_docs = await crud.get_data_by_similarity(collection_name, query_embedding, top_k=5)
-        channel_info = await crud.get_data_by_id(f"channel_info_{request.guild_id}", [request.channel_id])
+        # identical questions in flight for this channel share one computation
+        key = ('channel_query', request.channel_id, normalize_query(request.query))
+        result = await single_flight.run(key, lambda: answer_channel_query(request))
+        logging.info(f"Answer: {result['answer']}")
+        return result
 
-        content = relevant_docs.get('documents')[0]
-        data = channel_info.get('metadatas')[0]
+    except Exception as e:
+        logging.error(f"Error with channel related question: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        logging.info(f"Relevant messages: {content}")
-        logging.info(f"Channel info: {data}")
+async def stream_answer(tokens, error_message):
+    """Wraps a token generator for a StreamingResponse, errors mid-stream end the answer politely"""
+    try:
+        async for token in tokens:
+            yield token
+    except Exception as e:
+        logging.error(f"{error_message}: {e}")
+        yield "\nI'm sorry, something went wrong while answering that question."
 
-        # combine the relevant messages and channel info
-        combined_data = {
-            'relevant_messages': content,
-            'channel_info': channel_info
-        }
+async def answer_channel_query_stream(request: QueryRequest):
+    query_embedding = await generate_embedding(request.query)
+    collection_name = f"chat_history_{request.channel_id}"
 
-        answer = await fetchGptResponse(request.query, PROMPTS['channel_summarizer'], combined_data)
+    async def answer_query(sources):
+        combined_data, message_sources = await channel_context(request, query_embedding)
+        sources.extend(message_sources)
+        async for token in fetchGptResponseStream(request.query, PROMPTS['channel_summarizer'], combined_data):
+            yield token
+
+    async for token in answer_cache.stream_or_compute(collection_name, query_embedding, answer_query):
+        yield token
+
+@app.post('/channel_query/stream')
+async def channel_query_stream(request: QueryRequest):
+    # identical questions streaming in this channel share one computation, later ones replay its tokens
+    key = ('channel_query/stream', request.channel_id, normalize_query(request.query))
+    tokens = single_flight.stream(key, lambda: answer_channel_query_stream(request))
+    return StreamingResponse(
+        stream_answer(tokens, "Error with streaming channel related question"),
+        media_type="text/plain"
+    )
+
+async def answer_guild_query(request: QueryRequest):
+    # one query embedding shared by every channel collection of the guild
+    query_embedding = await generate_embedding(request.query)
+    relevant_docs = await crud.get_data_by_similarity_guild(request.guild_id, query_embedding, top_k=5)
+
+    content = build_context(relevant_docs, token_budget=CONTEXT_TOKEN_BUDGET, source_key='channel_name')
+    logging.info(f"Relevant messages: {content}")
+
+    combined_data = {
+        'relevant_messages': content
+    }
+
+    return await fetchGptResponse(request.query, PROMPTS['channel_summarizer'], combined_data)
+
+@app.post('/guild_query') #, response_model=QueryResponse
+async def guild_query(request: QueryRequest):
+    try:
+        key = ('guild_query', request.guild_id, normalize_query(request.query))
+        answer = await single_flight.run(key, lambda: answer_guild_query(request))
         logging.info(f"Answer: {answer}")
         return {'answer': answer}
 
     except Exception as e:
-        logging.error(f"Error with channel related question: {e}")
+        logging.error(f"Error with server related question: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post('/resource_query') #, response_model=QueryResponse
 async def resource_query(request: QueryRequest):
     try:
         # response = await process_query(crud, request)
-        response = await semantic_router.process_query(request)
+        # course material answers don't depend on the channel, coalesce per guild
+        key = ('resource_query', request.guild_id, normalize_query(request.query))
+        response = await single_flight.run(key, lambda: semantic_router.process_query(request))
 
         if response is None:
             raise ValueError("Process_query returned none")
@@ -70,11 +194,33 @@ async def resource_query(request: QueryRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
     
+@app.post('/resource_query/stream')
+async def resource_query_stream(request: QueryRequest):
+    key = ('resource_query/stream', request.guild_id, normalize_query(request.query))
+    tokens = single_flight.stream(key, lambda: semantic_router.process_query_stream(request))
+    return StreamingResponse(
+        stream_answer(tokens, "Error with streaming course material related question"),
+        media_type="text/plain"
+    )
+
+@app.post('/route_batch')
+async def route_batch(request: RouteBatchRequest):
+    try:
+        if request.collection_name:
+            routes = await semantic_router.route_collection(request.collection_name)
+        else:
+            routes = await semantic_router.route_batch(queries=request.queries, embeddings=request.embeddings)
+        return {'routes': routes}
+
+    except Exception as e:
+        logging.error(f"Error with batch routing: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post('/update_chat_history')
 async def update_chat_history(request: UpdateChatHistory):
     all_messages = request.all_messages
     total_messages = sum([len(messages) for messages in all_messages.values()])
-    chat_history = []
+    chat_infos, collection_names = [], []
     for _, channel_messages in all_messages.items():
         for message in channel_messages:
             message_info = {
@@ -87,18 +233,21 @@ async def update_chat_history(request: UpdateChatHistory):
                 "timestamp": message.timestamp,
                 "profanity_score": message.profanity_score
             }
-            # Pass the chat history to modelsChroma to get document and embedding
-            try:
-                chat_info = ChatHistory(message_info)
-                document, embedding = await chat_info.to_document()
-            except Exception as e:
-                logging.error(f"Error with updating chat history: {e}")
-            
+            chat_infos.append(ChatHistory(message_info))
+            collection_names.append(f"chat_history_{message_info.get('channel_id')}")
+
+    # Pass the chat history to modelsChroma to get documents and embeddings in batches
+    chat_history = []
+    try:
+        documents = await to_documents(chat_infos)
+        for collection_name, (document, embedding) in zip(collection_names, documents):
             chat_history.append({
-                "collection_name": f"chat_history_{message_info.get('channel_id')}",
+                "collection_name": collection_name,
                 "document": document,
                 "embedding": embedding
             })
+    except Exception as e:
+        logging.error(f"Error with updating chat history: {e}")
 
     # Save chat history to Chromadb
     try:
@@ -147,14 +296,11 @@ async def load_course_materials():
     file_path = "./data/pdf_files"
     collection_name = "course_materials"
     try:
-        data = await crud.save_pdfs(file_path, collection_name)
-
-        # save the data to the database in chunks of ten documents
-        chunk_size = 10
-        for i in range(0, len(data), chunk_size):
-            await crud.save_to_db(data[i:i+chunk_size])
+        # save_pdfs skips unchanged files and writes the new chunks itself
+        summary = await crud.save_pdfs(file_path, collection_name)
+        logging.info(f"Course materials loaded: {summary}")
 
-        return {"message": "PDFs loaded successfully."}
+        return {"message": "PDFs loaded successfully.", **summary}
     
     except Exception as e:
         logging.error(f"app.py: Error with loading PDFs: {e}")
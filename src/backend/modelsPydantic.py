@@ -7,6 +7,11 @@ class QueryRequest(BaseModel):
     channel_id: int
     query: str
 
+class RouteBatchRequest(BaseModel):
+    queries: Optional[List[str]] = None
+    embeddings: Optional[List[List[float]]] = None
+    collection_name: Optional[str] = None
+
 class QueryResponse(BaseModel):
     answer: str
 
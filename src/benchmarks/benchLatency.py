@@ -0,0 +1,183 @@
+# benchLatency.py
+# Offline latency benchmark for the LLM fetch functions and the query endpoints.
+# OpenAI is replaced by the local fake server in fakeOpenAI.py and chroma runs on a
+# temporary directory, so results are reproducible and regressions show up as numbers.
+#
+# Usage: python src/benchmarks/benchLatency.py --concurrency 1,4,16 --requests 64
+# Note: tiktoken encodings must already be cached locally (run once with network
+# access, or point TIKTOKEN_CACHE_DIR at a cache) for a fully offline run.
+import asyncio, functools, json, os, sys, tempfile, time
+import fire
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from benchmarks.fakeOpenAI import start_fake_server
+
+def configure_environment(base_url, db_path):
+    # must run before any project module reads utlis.config
+    os.environ["OPENAI_API_KEY"] = "sk-fake"
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_BASE"] = base_url
+    os.environ["DB_PATH"] = db_path
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(db_path, "embedding_cache.sqlite3")
+    os.environ.setdefault("DISCORD_TOKEN", "fake")
+    os.environ.setdefault("PROFANITY_THRESHOLD", "0.8")
+    os.environ.setdefault("DISTANCE_THRESHOLD", "0.1")
+    # measure the uncached path, every request is a distinct question anyway
+    os.environ.setdefault("ANSWER_CACHE_THRESHOLD", "1.01")
+
+def summarize(name, concurrency, latencies, errors, wall):
+    percentiles = np.percentile(latencies, [50, 95, 99]) * 1000 if latencies else [float('nan')] * 3
+    return {
+        "name": name,
+        "concurrency": concurrency,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": round(float(percentiles[0]), 1),
+        "p95_ms": round(float(percentiles[1]), 1),
+        "p99_ms": round(float(percentiles[2]), 1),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+    }
+
+async def measure(name, call, concurrency, requests):
+    """Runs call(i) for i in range(requests) with at most `concurrency` in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call(i)
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                errors += 1
+                print(f"{name} request {i} failed: {e}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    return summarize(name, concurrency, latencies, errors, time.perf_counter() - start)
+
+async def seed_database(crud, documents):
+    """Fills course_materials and one channel with synthetic documents"""
+    from langchain.schema import Document
+    from database.modelsChroma import generate_embeddings
+
+    topics = ["boom construction", "lab report", "benchmark", "soldering", "arduino", "final presentation"]
+    texts = [f"Document {i} about {topics[i % len(topics)]} rules and deadlines for lab {i % 12}." for i in range(documents)]
+    embeddings = await generate_embeddings(texts)
+
+    data = []
+    for i, (text, embedding) in enumerate(zip(texts, embeddings)):
+        data.append({
+            "collection_name": "course_materials",
+            "document": Document(page_content=text, metadata={"id": f"doc-{i}", "source": f"source {i % 10}"}),
+            "embedding": embedding
+        })
+        data.append({
+            "collection_name": "chat_history_1",
+            "document": Document(page_content=text, metadata={
+                "id": i, "channel_name": "general", "author": f"user{i % 7}",
+                "timestamp": "2024-01-01T00:00:00", "profanity_score": 0.0
+            }),
+            "embedding": embedding
+        })
+
+    data.append({
+        "collection_name": "channel_info_1",
+        "document": Document(page_content="general course discussion", metadata={
+            "id": 1, "guild_id": 1, "channel_name": "general", "number_of_messages": documents,
+            "number_of_members": 7, "last_message_timestamp": "null", "first_message_timestamp": "null",
+            "profanity_score": 0.0
+        }),
+        "embedding": embeddings[0]
+    })
+    await crud.save_to_db(data)
+
+async def run(concurrency_levels, requests, documents):
+    import httpx
+    from services import queryLangchain
+    from backend.app import app, crud
+
+    await seed_database(crud, documents)
+    role = "You are a course instructor."
+    data = ["Document about boom construction rules."] * 5
+
+    async def stream_to_end(question):
+        async for _ in queryLangchain.fetchGptResponseStream(question, role, data):
+            pass
+
+    async def first_token(question):
+        async for _ in queryLangchain.fetchGptResponseStream(question, role, data):
+            break
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120.0) as client:
+        async def post(route, question):
+            response = await client.post(route, json={"guild_id": 1, "channel_id": 1, "query": question})
+            response.raise_for_status()
+
+        def routed_question(run, i):
+            # long enough and without "<word> <number>" terms, so it is embedded and routed
+            # instead of taking the exact course term (BM25 only) fast path
+            return f"what are the boom competition rules for our team design, case [{run}.{i}]?"
+
+        variants = {
+            "fetchGptResponse": lambda run, i: queryLangchain.fetchGptResponse(f"question {i} of run {run}", role, data),
+            "fetchGptResponseTwo": lambda run, i: queryLangchain.fetchGptResponseTwo(f"question {i} of run {run}", role, data),
+            "fetchLangchainResponse": lambda run, i: queryLangchain.fetchLangchainResponse(f"question {i} of run {run}", "course_materials", top_k=5),
+            "fetchGptResponseStream (first token)": lambda run, i: first_token(f"question {i} of run {run}"),
+            "fetchGptResponseStream (full)": lambda run, i: stream_to_end(f"question {i} of run {run}"),
+            "/resource_query": lambda run, i: post("/resource_query", routed_question(run, i)),
+            "/resource_query (exact term)": lambda run, i: post("/resource_query", f"lab {run * requests + i}"),
+            "/channel_query": lambda run, i: post("/channel_query", routed_question(run, i)),
+        }
+
+        results = []
+        for name, call in variants.items():
+            for run, concurrency in enumerate(concurrency_levels):
+                # questions differ between concurrency levels, otherwise later levels would hit
+                # the embedding cache warmed by the earlier ones and skip the embedding latency
+                result = await measure(name, functools.partial(call, run), concurrency, requests)
+                print(
+                    f"{name:<40} c={concurrency:<4} p50={result['p50_ms']:>8}ms p95={result['p95_ms']:>8}ms "
+                    f"p99={result['p99_ms']:>8}ms {result['throughput_rps']:>8} req/s errors={result['errors']}"
+                )
+                results.append(result)
+
+    await queryLangchain.llm_gateway.aclose()
+    return results
+
+def main(
+        concurrency: str = "1,4,16",
+        requests: int = 32,
+        documents: int = 200,
+        latency: float = 0.3,
+        token_rate: float = 50.0,
+        completion_tokens: int = 100,
+        embedding_latency: float = 0.05,
+        port: int = 8765,
+        output: str = None
+):
+    # fire turns "1,4,16" into a tuple already
+    if isinstance(concurrency, (list, tuple)):
+        concurrency_levels = [int(level) for level in concurrency]
+    else:
+        concurrency_levels = [int(level) for level in str(concurrency).split(",")]
+    start_fake_server(
+        port=port, latency=latency, token_rate=token_rate,
+        completion_tokens=completion_tokens, embedding_latency=embedding_latency
+    )
+
+    with tempfile.TemporaryDirectory() as db_path:
+        configure_environment(f"http://127.0.0.1:{port}/v1", db_path)
+        results = asyncio.run(run(concurrency_levels, requests, documents))
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f"Results saved to {output}")
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,200 @@
+# evalRouter.py
+# Accuracy and latency evaluation of the routers over the labeled utterances in
+# router/utterances.py. Utterances are split into stratified folds, every router is
+# fitted on the training folds and asked to route the held-out ones. Embeddings come
+# from the deterministic local encoder of fakeOpenAI.py, so no network is needed and
+# runs are reproducible.
+#
+# Usage: python src/benchmarks/evalRouter.py --folds 5 --routers centroid,hierarchical,route_layer --output eval.json
+import json, os, random, sys, time
+from functools import lru_cache
+import fire
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from benchmarks.fakeOpenAI import hash_embedding
+from router.utterances import UTTERANCES
+from router.experts import EXPERTS
+from router.centroidRouter import CentroidRouter
+from router.hierarchicalRouter import HierarchicalRouter
+
+FALLBACK = "fallback"
+
+@lru_cache(maxsize=None)
+def encode(text):
+    return hash_embedding(text)
+
+class CentroidAdapter:
+    name = "centroid"
+
+    def fit(self, train):
+        self.router = CentroidRouter({route: [encode(u) for u in utterances] for route, utterances in train.items()}, threshold=0.0)
+
+    def predict(self, query, threshold):
+        scores = self.router.scores(encode(query))[0]
+        best = int(np.argmax(scores))
+        return self.router.routes[best] if scores[best] >= threshold else None
+
+class HierarchicalAdapter:
+    name = "hierarchical"
+
+    def fit(self, train):
+        self.router = HierarchicalRouter(EXPERTS, {route: [encode(u) for u in utterances] for route, utterances in train.items()}, threshold=0.0)
+
+    def predict(self, query, threshold):
+        # the same decision as the backend: the first entry of rank(), kept above the threshold
+        route, score, _ = self.router.rank(encode(query))[0]
+        return route if score >= threshold else None
+
+class RouteLayerAdapter:
+    """The semantic_router RouteLayer the backend used before, with the same local encoder"""
+    name = "route_layer"
+
+    def fit(self, train):
+        from semantic_router import Route, RouteLayer
+        from semantic_router.encoders import BaseEncoder
+
+        class HashEncoder(BaseEncoder):
+            name: str = "hash"
+            score_threshold: float = 0.0
+            type: str = "local"
+
+            def __call__(self, docs):
+                return [encode(doc).tolist() for doc in docs]
+
+        self.layer = RouteLayer(encoder=HashEncoder(), routes=[
+            Route(name=route, utterances=utterances) for route, utterances in train.items()
+        ])
+        self.threshold = None
+
+    def predict(self, query, threshold):
+        if threshold != self.threshold:
+            self.layer.score_threshold = threshold
+            for route in self.layer.routes:
+                route.score_threshold = threshold
+            self.threshold = threshold
+        return self.layer(query).name
+
+ADAPTERS = {adapter.name: adapter for adapter in (CentroidAdapter, HierarchicalAdapter, RouteLayerAdapter)}
+
+def make_folds(utterances, folds, seed):
+    """Stratified folds: [{route: [held out utterances]}] per fold"""
+    rng = random.Random(seed)
+    split = [{route: [] for route in utterances} for _ in range(folds)]
+    for route, texts in utterances.items():
+        texts = list(texts)
+        rng.shuffle(texts)
+        for i, text in enumerate(texts):
+            split[i % folds][route].append(text)
+    return split
+
+def metrics(pairs, routes):
+    """Accuracy, per-route precision/recall and the confusion matrix of (expected, predicted) pairs"""
+    labels = list(routes) + [FALLBACK]
+    confusion = {expected: {predicted: 0 for predicted in labels} for expected in labels}
+    for expected, predicted in pairs:
+        confusion[expected][predicted or FALLBACK] += 1
+
+    per_route = {}
+    for route in routes:
+        true_positive = confusion[route][route]
+        predicted = sum(confusion[expected][route] for expected in labels)
+        actual = sum(confusion[route].values())
+        precision = true_positive / predicted if predicted else 0.0
+        recall = true_positive / actual if actual else 0.0
+        per_route[route] = {
+            "precision": round(precision, 3),
+            "recall": round(recall, 3),
+            "f1": round(2 * precision * recall / (precision + recall), 3) if precision + recall else 0.0,
+        }
+
+    routed = [predicted for _, predicted in pairs if predicted]
+    return {
+        "accuracy": round(sum(expected == predicted for expected, predicted in pairs) / len(pairs), 3),
+        "coverage": round(len(routed) / len(pairs), 3),
+        "per_route": per_route,
+        "confusion": confusion,
+    }
+
+def evaluate(adapter_class, splits, thresholds, default_threshold):
+    """Cross-validated predictions for every threshold, plus per-query latency at the default threshold"""
+    pairs = {threshold: [] for threshold in thresholds}
+    latencies = []
+    for i, test in enumerate(splits):
+        train = {route: [u for j, split in enumerate(splits) if j != i for u in split[route]] for route in test}
+        adapter = adapter_class()
+        adapter.fit(train)
+
+        for threshold in thresholds:
+            for route, queries in test.items():
+                for query in queries:
+                    pairs[threshold].append((route, adapter.predict(query, threshold)))
+
+        for route, queries in test.items():
+            for query in queries:
+                start = time.perf_counter()
+                adapter.predict(query, default_threshold)
+                latencies.append(time.perf_counter() - start)
+
+    percentiles = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {
+        "sweep": {threshold: metrics(pairs[threshold], splits[0].keys()) for threshold in thresholds},
+        "latency_ms": {
+            "p50": round(float(percentiles[0]), 3),
+            "p95": round(float(percentiles[1]), 3),
+            "p99": round(float(percentiles[2]), 3),
+            "max": round(max(latencies) * 1000, 3),
+        },
+    }
+
+def print_report(name, result, default_threshold):
+    print(f"\n=== {name} ===")
+    latency = result["latency_ms"]
+    print(f"latency per query: p50={latency['p50']}ms p95={latency['p95']}ms p99={latency['p99']}ms max={latency['max']}ms")
+
+    print("threshold sweep:")
+    for threshold, sweep in result["sweep"].items():
+        print(f"  {threshold:>5}: accuracy={sweep['accuracy']:<6} coverage={sweep['coverage']}")
+
+    default = result["sweep"][default_threshold]
+    print(f"per route at threshold {default_threshold}:")
+    for route, scores in default["per_route"].items():
+        print(f"  {route:<18} precision={scores['precision']:<6} recall={scores['recall']:<6} f1={scores['f1']}")
+
+    labels = list(default["confusion"])
+    print("confusion matrix (rows expected, columns predicted):")
+    print(" " * 18 + "".join(f"{label[:10]:>12}" for label in labels))
+    for expected in labels:
+        print(f"  {expected:<16}" + "".join(f"{default['confusion'][expected][predicted]:>12}" for predicted in labels))
+
+def main(
+        folds: int = 5,
+        routers: str = "centroid,hierarchical,route_layer",
+        thresholds: str = "0.0,0.1,0.2,0.3,0.4,0.5",
+        threshold: float = 0.0,
+        seed: int = 0,
+        output: str = None
+):
+    # fire turns comma separated values into tuples already
+    names = routers if isinstance(routers, (list, tuple)) else routers.split(",")
+    thresholds = [float(t) for t in (thresholds if isinstance(thresholds, (list, tuple)) else str(thresholds).split(","))]
+    if threshold not in thresholds:
+        thresholds.append(threshold)
+
+    splits = make_folds(UTTERANCES, folds, seed)
+    results = {}
+    for name in names:
+        try:
+            results[name] = evaluate(ADAPTERS[name], splits, thresholds, threshold)
+        except ImportError as e:
+            print(f"Skipping {name}: {e}")
+            continue
+        print_report(name, results[name], threshold)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f"Results saved to {output}")
+
+if __name__ == "__main__":
+    fire.Fire(main)
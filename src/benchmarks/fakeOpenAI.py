@@ -0,0 +1,125 @@
+# fakeOpenAI.py
+# Local stand-in for the OpenAI API (chat completions + embeddings) used by the benchmarks.
+# Latency and token rate are configurable and embeddings are deterministic, so runs
+# are reproducible and need no network or API key.
+import asyncio, hashlib, json, re, threading, time, uuid
+import fire, uvicorn
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+EMBEDDING_DIM = 1536
+
+def hash_embedding(text, dim=EMBEDDING_DIM):
+    """
+    Deterministic bag-of-words embedding: every token is hashed to a signed
+    dimension, so texts sharing words get similar vectors.
+    """
+    if isinstance(text, list):
+        # langchain may send token ids instead of text
+        tokens = [str(token) for token in text]
+    else:
+        tokens = re.findall(r'\w+', text.lower())
+
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in tokens or [""]:
+        digest = hashlib.md5(token.encode('utf-8')).digest()
+        index = int.from_bytes(digest[:4], 'little') % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def create_app(latency=0.3, token_rate=50.0, completion_tokens=100, embedding_latency=0.05):
+    """
+    latency: seconds before the first token, token_rate: tokens per second after it,
+    completion_tokens: tokens per answer, embedding_latency: seconds per embedding request
+    """
+    app = FastAPI()
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+
+    def completion_id():
+        return f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+    def prompt_tokens(messages):
+        return sum(len(str(message.get('content', '')).split()) for message in messages)
+
+    @app.post('/v1/chat/completions')
+    async def chat_completions(request: Request):
+        body = await request.json()
+        tokens = min(body.get('max_tokens') or completion_tokens, completion_tokens)
+        usage = {
+            "prompt_tokens": prompt_tokens(body.get('messages', [])),
+            "completion_tokens": tokens,
+            "total_tokens": prompt_tokens(body.get('messages', [])) + tokens
+        }
+        id, created, model = completion_id(), int(time.time()), body.get('model', 'fake')
+
+        if not body.get('stream'):
+            await asyncio.sleep(latency + tokens / token_rate)
+            content = " ".join(words[i % len(words)] for i in range(tokens))
+            return {
+                "id": id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage
+            }
+
+        async def events():
+            await asyncio.sleep(latency)
+            for i in range(tokens):
+                chunk = {
+                    "id": id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": f"{words[i % len(words)]} "}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(1 / token_rate)
+
+            if (body.get('stream_options') or {}).get('include_usage'):
+                chunk = {"id": id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": [], "usage": usage}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post('/v1/embeddings')
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body['input']
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+
+        await asyncio.sleep(embedding_latency)
+        return {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": hash_embedding(text).tolist()}
+                for i, text in enumerate(inputs)
+            ],
+            "model": body.get('model', 'fake'),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0}
+        }
+
+    return app
+
+def start_fake_server(host="127.0.0.1", port=8765, **kwargs):
+    """Runs the fake server in a background thread, returns once it accepts connections"""
+    config = uvicorn.Config(create_app(**kwargs), host=host, port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+def main(
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        latency: float = 0.3,
+        token_rate: float = 50.0,
+        completion_tokens: int = 100,
+        embedding_latency: float = 0.05
+):
+    app = create_app(latency, token_rate, completion_tokens, embedding_latency)
+    uvicorn.run(app, host=host, port=port)
+
+if __name__ == "__main__":
+    fire.Fire(main)
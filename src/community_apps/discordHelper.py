@@ -1,21 +1,29 @@
 import os, json, httpx, discord, logging
-import numpy as np 
-from profanity_check import predict_prob
 from database.modelsChroma import (
     GuildInfo, ChannelInfo, MemberInfoChannel
 )
 from services.nlpTools import TextProcessor
-from utlis.config import PROFANITY_THRESHOLD
+from services.profanityScorer import ProfanityScorer
+from utlis.config import PROFANITY_THRESHOLD, PROFANITY_BATCH_WINDOW, PROFANITY_MEMO_SIZE
 from backend.modelsPydantic import UpdateChatHistory, Message
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 nlp_tools = TextProcessor()
+profanity_scorer = ProfanityScorer(batch_window=PROFANITY_BATCH_WINDOW, memo_size=PROFANITY_MEMO_SIZE)
 
 async def send_to_app(route, data):
     async with httpx.AsyncClient(timeout=60.0) as client:
         response = await client.post(f'http://localhost:8000/{route}', json=data)
     return response
 
+async def stream_from_app(route, data):
+    """Yields the text of a streaming endpoint as it arrives"""
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        async with client.stream('POST', f'http://localhost:8000/{route}', json=data) as response:
+            response.raise_for_status()
+            async for text in response.aiter_text():
+                yield text
+
 async def update_message(all_messages, bot_user, chunk_size=25):
     for channel_id, messages in all_messages.items():
         for chunk in chunk_list(messages, chunk_size):
@@ -39,8 +47,12 @@ async def get_parameters(interaction_data):
     logging.info(f"Updating message: {content}")
     data = {}
 
-    profanity_scores = await profanity_checker([content]) # returns a numpy array
-    logging.info(f"Profanity score: {profanity_scores[0]}")
+    # callers that already scored the message pass the score along, otherwise it's
+    # scored here (memoized by message id, so a message is never scored twice)
+    profanity_score = interaction_data.get("profanity_score")
+    if profanity_score is None:
+        profanity_score = await profanity_scorer.score(content, message_id)
+    logging.info(f"Profanity score: {profanity_score}")
     message_info = {
         "channel_id": channel.id,
         "channel_name": channel.name,
@@ -49,7 +61,7 @@ async def get_parameters(interaction_data):
         "author_id": author.id,
         "content": content,
         "timestamp": created_at.isoformat(),
-        "profanity_score": profanity_scores[0]
+        "profanity_score": profanity_score
     }
 
     data[channel.id] = [message_info]
@@ -72,10 +84,15 @@ async def get_channels_and_messages(guild, bot_user, limit=500):
         if channel['type'] == 'text':
             discord_channel = guild.get_channel(channel['id'])
             all_text_channels.append(discord_channel)
+            history = [message async for message in discord_channel.history(limit=limit)]
+
+            # the whole channel history is scored in one vectorized call
+            profanity_scores = await profanity_scorer.score_many(
+                [message.content for message in history], [message.id for message in history]
+            )
+
             messages = []
-            async for message in discord_channel.history(limit=limit):
-                profanity_scores = await profanity_checker([message.content])
-                profanity_score = profanity_scores[0]
+            for message, profanity_score in zip(history, profanity_scores):
                 if profanity_score > PROFANITY_THRESHOLD or await message_filter(message, bot_user):
                     messages.append({
                         "channel_id": message.channel.id,
@@ -121,25 +138,13 @@ async def available_commands():
         "   1. /info - List available commands"
         "2. /channel - Queries related to channel\n"
         "3. /resource - Queries related to the course\n"
-        "4. /setup - Use ONLY ONE time to setup chat history and server information. \n"
-        "5. /load_course_materials - use ONLY ONE time to load course materials from course website\n"
-        "6. /remove - Remove bot from channel\n"
+        "4. /server - Queries across every channel in the server\n"
+        "5. /setup - Use ONLY ONE time to setup chat history and server information. \n"
+        "6. /load_course_materials - use ONLY ONE time to load course materials from course website\n"
+        "7. /remove - Remove bot from channel\n"
     )
     return commands
 
-# Calculate the profanity score of a message
-async def profanity_checker(messages):
-    contents = [message for message in messages]
-    # save the content in a list; message should be a str
-    for message in messages:
-        contents.append(message)
-
-    profanity_scores = predict_prob(contents) # numpy list
-    # total_score = sum(profanity_scores)
-    # average_score = total_score / len(messages) if messages else 0
-
-    return profanity_scores
-
 async def store_guild_info(guild, average_score):
     # store only the text channels
     channels = [
@@ -158,8 +163,7 @@ async def store_guild_info(guild, average_score):
 
 async def store_channel_info(channel, guild_id, messages):
     # profanity score is already stored in the message
-    profanity_scores = np.array([msg['profanity_score'] for msg in messages])
-    total_score = np.sum(profanity_scores)
+    total_score = sum(msg['profanity_score'] for msg in messages)
     average_score = total_score / len(messages) if messages else 0
 
     # Extract content from messages
@@ -1,18 +1,21 @@
 import json, os, discord, logging, httpx, time, asyncio
 from discord.ext import commands
 from discord import app_commands
-from profanity_check import predict, predict_prob
 
-from utlis.config import DISCORD_TOKEN, PROFANITY_THRESHOLD
+from utlis.config import DISCORD_TOKEN, PROFANITY_THRESHOLD, STREAM_EDIT_INTERVAL
 from community_apps.discordHelper import (
-    send_to_app, update_message, get_channels_and_messages, message_filter, available_commands,
+    send_to_app, stream_from_app, update_message, get_channels_and_messages, message_filter, available_commands,
     store_guild_info, store_channel_info, store_member_info, store_channel_list, get_parameters,
-    profanity_checker
+    profanity_scorer
 )
 from backend.modelsPydantic import Message, UpdateChatHistory
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# Queries whose answer is streamed into the followup message as it is generated
+STREAMING_QUERIES = {'resource_query', 'channel_query'}
+DISCORD_MESSAGE_LIMIT = 2000
+
 class DiscordBot:
     def __init__(self, bot):
         self.bot = bot
@@ -37,8 +40,8 @@ class DiscordBot:
                 self.message_global = message       
 
                 try:
-                    profanity_scores = await profanity_checker([message.content])
-                    profanity_score = profanity_scores[0]
+                    # concurrent messages are scored together, off the event loop
+                    profanity_score = await profanity_scorer.score(message.content, message.id)
                     
                     if profanity_score > PROFANITY_THRESHOLD:
                         try:
@@ -49,7 +52,15 @@ class DiscordBot:
                             logging.error(f"Error with deleting message: {e}")
 
                     if profanity_score > PROFANITY_THRESHOLD or await message_filter(message, self.bot.user):
-                        message_info = await get_parameters(message)
+                        message_info = await get_parameters({
+                            "content": message.content,
+                            "author": message.author,
+                            "channel": message.channel,
+                            "guild": message.guild,
+                            "id": message.id,
+                            "created_at": message.created_at,
+                            "profanity_score": profanity_score
+                        })
                         asyncio.create_task(update_message(message_info, self.bot.user))
 
                 except Exception as e:
@@ -96,6 +107,11 @@ class DiscordBot:
         async def channel(interaction: discord.Interaction, query: str):
             await self.handle_query(interaction, 'channel_query', query)
 
+        @self.tree.command(name="server", description="Query across every channel in the server")
+        @app_commands.describe(query="The query you want to ask")
+        async def server(interaction: discord.Interaction, query: str):
+            await self.handle_query(interaction, 'guild_query', query)
+
 
     async def update_server_info(self, interaction: discord.Interaction):
         logging.info("Updating server information and chat history to ChromaDB...")
@@ -167,9 +183,8 @@ class DiscordBot:
 
         await interaction.response.send_message(f"/{query_type} {query}")
         
-        # Calculate profanity score for the query
-        profanity_scores = await profanity_checker([query])
-        profanity_score = profanity_scores[0]
+        # Calculate profanity score for the query, once
+        profanity_score = await profanity_scorer.score(query, interaction.id)
 
         # Process and update the message to the database
         message_info = await get_parameters({
@@ -178,7 +193,8 @@ class DiscordBot:
             "channel": interaction.channel,
             "guild": interaction.guild,
             "id": interaction.id,
-            "created_at": interaction.created_at
+            "created_at": interaction.created_at,
+            "profanity_score": profanity_score
         })
 
         if profanity_score > PROFANITY_THRESHOLD:
@@ -186,6 +202,10 @@ class DiscordBot:
             return
 
         asyncio.create_task(update_message(message_info, self.bot.user))
+
+        if query_type in STREAMING_QUERIES:
+            await self.stream_query(interaction, query_type, data)
+            return
         
         response = await send_to_app(query_type, data)
 
@@ -204,3 +224,23 @@ class DiscordBot:
             await interaction.followup.send(combined_result)
         else:
             await interaction.followup.send("Failed to get response from LLM.")
+
+    async def stream_query(self, interaction: discord.Interaction, query_type, data):
+        """Streams the answer into the followup message, editing it at most every STREAM_EDIT_INTERVAL seconds"""
+        message = await interaction.followup.send("...", wait=True)
+        result = ""
+        last_edit = 0.0  # the first tokens are shown right away
+
+        try:
+            async for text in stream_from_app(f"{query_type}/stream", data):
+                result += text
+                # discord rate limits message edits, so only edit every so often
+                if time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                    await message.edit(content=result[:DISCORD_MESSAGE_LIMIT])
+                    last_edit = time.monotonic()
+
+            await message.edit(content=(result or "No result found")[:DISCORD_MESSAGE_LIMIT])
+
+        except Exception as e:
+            logging.error(f"Error with streaming {query_type}: {e}")
+            await message.edit(content="Failed to get response from LLM.")
@@ -1,49 +1,159 @@
 # crudChroma.py
-import chromadb, uuid, os, urllib.parse, asyncio
+import chromadb, os, urllib.parse, asyncio, logging, time, functools, heapq, ast, multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 
-from utlis.config import DB_PATH
-from database.modelsChroma import generate_embedding
+from utlis.config import (
+    DB_PATH, CHROMA_UPSERT_BATCH_SIZE, CHROMA_MAX_WORKERS, INGEST_BATCH_SIZE, INGEST_QUEUE_SIZE,
+    INGEST_WORKERS
+)
+from database.modelsChroma import generate_embeddings
 from services.getPdfs import read_hyperlinks, match_filenames_to_urls
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import DirectoryLoader
+from services.pdfChunker import load_and_split
+from langchain.schema import Document
+from database.ingestManifest import IngestManifest, make_chunk_id
+from database.lexicalIndex import LexicalIndex, reciprocal_rank_fusion
+
+
+def chunk_list(data, chunk_size):
+    for i in range(0, len(data), chunk_size):
+        yield data[i:i + chunk_size]
+
+def merge_results(collection_names, results, top_k):
+    """Merges collection.query results of several collections into one global top-k by distance"""
+    candidates = []
+    for collection_name, result in zip(collection_names, results):
+        if not result or not result.get('ids'):
+            continue
+        for id, document, metadata, distance in zip(
+            result['ids'][0], result['documents'][0], result['metadatas'][0], result['distances'][0]
+        ):
+            metadata = dict(metadata or {}, collection=collection_name)
+            candidates.append((distance, id, document, metadata))
+
+    top = heapq.nsmallest(top_k, candidates, key=lambda candidate: candidate[0])
+
+    # keep the same nested layout as a single collection.query result
+    return {
+        'ids': [[candidate[1] for candidate in top]],
+        'documents': [[candidate[2] for candidate in top]],
+        'metadatas': [[candidate[3] for candidate in top]],
+        'distances': [[candidate[0] for candidate in top]],
+    }
 
 class CRUD():
     def __init__(self):
         self.client = chromadb.PersistentClient(path = DB_PATH)
-        
+
+        # every chroma call goes through this executor so SQLite I/O never
+        # runs on the event loop shared by the discord bot and uvicorn
+        self.executor = ThreadPoolExecutor(max_workers=CHROMA_MAX_WORKERS, thread_name_prefix="chroma")
+        self.collections = {}
+
+        # bumped on every write so caches can tell when a collection changed
+        self.versions = {}
+        self.write_listeners = []
+
+        # optional BM25 index for hybrid retrieval, see enable_lexical_index
+        self.lexical_index = None
+
+    def enable_lexical_index(self, tokenize, fastpath_max_tokens=6):
+        """Keeps a BM25 index per collection in sync with writes, used by get_data_hybrid"""
+        self.lexical_index = LexicalIndex(tokenize, fastpath_max_tokens)
+        self.add_write_listener(self.lexical_index.on_write)
+        return self.lexical_index
+
+    def add_write_listener(self, callback):
+        """Registers callback(collection_name, event), called after every upsert or delete"""
+        self.write_listeners.append(callback)
+
+    def collection_version(self, collection_name):
+        return self.versions.get(str(collection_name), 0)
+
+    def _notify_write(self, collection_name, event):
+        self.versions[collection_name] = self.versions.get(collection_name, 0) + 1
+        for callback in self.write_listeners:
+            try:
+                callback(collection_name, event)
+            except Exception as e:
+                logging.error(f"Error with write listener for {collection_name}: {e}")
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def get_collection(self, collection_name, create=False):
+        """Returns a cached collection handle, fetching (or creating) it on first use"""
+        collection_name = str(collection_name)
+        collection = self.collections.get(collection_name)
+        if collection is None:
+            if create:
+                collection = await self._run(self.client.get_or_create_collection, collection_name)
+            else:
+                collection = await self._run(self.client.get_collection, collection_name)
+            self.collections[collection_name] = collection
+        return collection
+
+    async def delete_collection(self, collection_name):
+        collection_name = str(collection_name)
+        self.collections.pop(collection_name, None)
+        await self._run(self.client.delete_collection, collection_name)
+        self._notify_write(collection_name, {"op": "drop", "ids": []})
+
     async def save_to_db(self, data):
+        # group the items by collection so each collection gets bulk upserts
+        # instead of one upsert (and one SQLite transaction) per item
+        grouped = {}
         for item in data:
-            collection_name, document, embedding = item['collection_name'], item['document'], item['embedding']
-
             # Change collection_name to type str since it was an int, but has to
             # be a str in order to be used as a collection name
-            collection_name = str(collection_name)
+            collection_name = str(item['collection_name'])
+            document, embedding = item['document'], item['embedding']
+            metadata = item.get('metadata', document.metadata)
 
-            # Note that collection_name is equivalent to channel_id
-            collection = await asyncio.to_thread(self.client.get_or_create_collection, collection_name)
-
-            await asyncio.to_thread(collection.upsert,
-                # Same for id, has to be a str
-                ids=[str(document.metadata['id'])],
-                documents=[document.page_content],
-                embeddings=[embedding],
-                metadatas=[document.metadata]
+            # Same for id, has to be a str; later items with the same id win
+            # since chroma rejects duplicate ids within one upsert
+            grouped.setdefault(collection_name, {})[str(metadata['id'])] = (
+                document.page_content, embedding, metadata
             )
 
-            print(f"'{document.page_content}' is added to the collection {collection_name}")
+        for collection_name, items in grouped.items():
+            # Note that collection_name is equivalent to channel_id
+            collection = await self.get_collection(collection_name, create=True)
+
+            ids = list(items.keys())
+            start = time.perf_counter()
+            for i in range(0, len(ids), CHROMA_UPSERT_BATCH_SIZE):
+                batch_ids = ids[i:i + CHROMA_UPSERT_BATCH_SIZE]
+                await self._run(collection.upsert,
+                    ids=batch_ids,
+                    documents=[items[id][0] for id in batch_ids],
+                    embeddings=[items[id][1] for id in batch_ids],
+                    metadatas=[items[id][2] for id in batch_ids]
+                )
+
+            self._notify_write(collection_name, {
+                "op": "upsert",
+                "ids": ids,
+                "documents": [items[id][0] for id in ids],
+                "embeddings": [items[id][1] for id in ids],
+                "metadatas": [items[id][2] for id in ids]
+            })
+
+            batches = (len(ids) + CHROMA_UPSERT_BATCH_SIZE - 1) // CHROMA_UPSERT_BATCH_SIZE
+            logging.info(
+                f"Upserted {len(ids)} documents into {collection_name} "
+                f"in {batches} batch(es), {time.perf_counter() - start:.3f}s"
+            )
 
     async def get_data_by_similarity(self, collection_name, query_embedding, top_k=10):
         try:
-            # Generate the embedding for the query
-            print(f"Retrieving documents for the collection: {collection_name}")
-
-            # Get the collection
-            collection = self.client.get_collection(collection_name)
-            print(f"Collection retrieved: {collection}")
+            logging.info(f"Retrieving documents for the collection: {collection_name}")
+            collection = await self.get_collection(collection_name)
 
             # Query the collection
-            results = collection.query(
+            results = await self._run(collection.query,
                 query_embeddings=[query_embedding],
                 n_results=top_k
             )
@@ -51,15 +161,17 @@ class CRUD():
             return results
 
         except Exception as e:
-            print(f"Error with retrieving relevant history: {e}")
+            # drop the handle in case the collection was removed underneath us
+            self.collections.pop(str(collection_name), None)
+            logging.error(f"Error with retrieving relevant history: {e}")
             return []
     
     async def get_data_by_id(self, collection_name, ids):
         # convert ids to str
         ids = [str(id) for id in ids]
         try:
-            collection = self.client.get_collection(collection_name)
-            results = collection.get(
+            collection = await self.get_collection(collection_name)
+            results = await self._run(collection.get,
                 ids=ids,
                 # where={"style": "style1"}
             )
@@ -67,52 +179,275 @@ class CRUD():
             return results
 
         except Exception as e:
-            print(f"Error with retrieving data by id: {e}")
+            self.collections.pop(str(collection_name), None)
+            logging.error(f"Error with retrieving data by id: {e}")
             return []
     
-    async def save_pdfs(self, file_path, collection_name):
-        print(f"Saving PDFs from {file_path} to collection {collection_name}")
-        # Get the files
-        try:
-            loader = DirectoryLoader(file_path, glob = "*.pdf", show_progress = True)
-            docs = loader.load()
+    async def get_data_hybrid(self, collection_name, query, query_embedding=None, top_k=10):
+        """
+        Fuses the BM25 and the vector ranking with reciprocal-rank fusion. Without a
+        query_embedding only the lexical ranking is used, so no embedding call is needed.
+        Returns the nested layout of collection.query, distances hold negated fused scores.
+        """
+        if self.lexical_index is None:
+            return await self.get_data_by_similarity(collection_name, query_embedding, top_k=top_k)
+
+        collection_name = str(collection_name)
+        candidates = top_k * 2
+
+        async def lexical_search():
+            try:
+                collection = await self.get_collection(collection_name)
+                await self.lexical_index.ensure_loaded(
+                    collection_name, functools.partial(collection.get, include=["documents"])
+                )
+                return await self._run(self.lexical_index.search, collection_name, query, candidates)
+            except Exception as e:
+                self.collections.pop(collection_name, None)
+                logging.error(f"Error with lexical search in {collection_name}: {e}")
+                return []
+
+        if query_embedding is not None:
+            lexical, vector = await asyncio.gather(
+                lexical_search(), self.get_data_by_similarity(collection_name, query_embedding, top_k=candidates)
+            )
+        else:
+            lexical, vector = await lexical_search(), []
+
+        found = {}
+        rankings = [[id for id, _ in lexical]]
+        if vector and vector.get('ids'):
+            rankings.append(vector['ids'][0])
+            for id, document, metadata in zip(vector['ids'][0], vector['documents'][0], vector['metadatas'][0]):
+                found[id] = (document, metadata)
+
+        fused = reciprocal_rank_fusion(rankings)[:top_k]
+        missing = [id for id, _ in fused if id not in found]
+        if missing:
+            results = await self.get_data_by_id(collection_name, missing)
+            if results:
+                for id, document, metadata in zip(results['ids'], results['documents'], results['metadatas']):
+                    found[id] = (document, metadata)
+
+        fused = [(id, score) for id, score in fused if id in found]
+        return {
+            'ids': [[id for id, _ in fused]],
+            'documents': [[found[id][0] for id, _ in fused]],
+            'metadatas': [[found[id][1] for id, _ in fused]],
+            'distances': [[-score for _, score in fused]],
+        }
+
+    async def get_data_hybrid_multi(self, collection_names, query, query_embedding=None, top_k=10):
+        """Hybrid retrieval over several collections concurrently, merged by fused score"""
+        results = await asyncio.gather(*[
+            self.get_data_hybrid(collection_name, query, query_embedding, top_k=top_k)
+            for collection_name in collection_names
+        ])
+        return merge_results(collection_names, results, top_k)
 
+    async def get_guild_collections(self, guild_id, prefix="chat_history"):
+        """Resolves the per-channel collections of a guild through channel_info / channel_list"""
+        channel_ids = set()
+        try:
+            collection = await self.get_collection(f"channel_info_{guild_id}")
+            results = await self._run(collection.get, include=[])
+            channel_ids.update(results.get('ids', []))
         except Exception as e:
-            print(f"crudChroma.py: Error with loading PDFs: {e}")
+            self.collections.pop(f"channel_info_{guild_id}", None)
+            logging.error(f"Error with retrieving channel info for guild {guild_id}: {e}")
+
+        if not channel_ids:
+            # fall back on the channels members are listed in
+            try:
+                collection = await self.get_collection(f"channel_list_{guild_id}")
+                results = await self._run(collection.get, include=["metadatas"])
+                for metadata in results.get('metadatas', []):
+                    channel_ids.update(str(id) for id in ast.literal_eval(metadata.get('channel_ids', '[]')))
+            except Exception as e:
+                self.collections.pop(f"channel_list_{guild_id}", None)
+                logging.error(f"Error with retrieving channel list for guild {guild_id}: {e}")
+
+        return [f"{prefix}_{channel_id}" for channel_id in sorted(channel_ids)]
+
+    async def get_data_by_similarity_multi(self, collection_names, query_embedding, top_k=10):
+        """Queries several collections concurrently and merges them into a global top-k by distance"""
+        results = await asyncio.gather(*[
+            self.get_data_by_similarity(collection_name, query_embedding, top_k=top_k)
+            for collection_name in collection_names
+        ])
+
+        return merge_results(collection_names, results, top_k)
+
+    async def get_data_by_similarity_guild(self, guild_id, query_embedding, top_k=10):
+        collection_names = await self.get_guild_collections(guild_id)
+        return await self.get_data_by_similarity_multi(collection_names, query_embedding, top_k=top_k)
+
+    async def delete_from_db(self, collection_name, ids):
+        if not ids:
+            return
+        collection = await self.get_collection(collection_name, create=True)
+        ids = [str(id) for id in ids]
+        await self._run(collection.delete, ids=ids)
+        self._notify_write(str(collection_name), {"op": "delete", "ids": ids})
+        logging.info(f"Deleted {len(ids)} documents from {collection_name}")
+
+    async def delete_untracked_chunks(self, collection_name):
+        try:
+            collection = await self.get_collection(collection_name)
+            results = await self._run(collection.get, include=[])
+        except Exception:
+            # nothing ingested yet
+            self.collections.pop(str(collection_name), None)
             return
-        
+        logging.info(f"No ingest manifest for {collection_name}, removing {len(results['ids'])} untracked chunks")
+        for ids in chunk_list(results['ids'], CHROMA_UPSERT_BATCH_SIZE):
+            await self.delete_from_db(collection_name, ids)
 
-        # split the text 
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size = 1000, 
-            chunk_overlap = 200
-        )
+    async def save_pdfs(self, file_path, collection_name):
+        """
+        Incrementally ingests the PDFs in file_path, only new or changed files are embedded.
+        Files stream through parse (load + split) -> embed -> upsert stages connected by bounded
+        queues, so memory stays flat and chunks become queryable while the rest is ingesting.
+        """
+        logging.info(f"Saving PDFs from {file_path} to collection {collection_name}")
+        manifest = IngestManifest(os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), f"manifest_{collection_name}.json"))
+        changed, unchanged, removed = await asyncio.to_thread(manifest.diff, file_path)
+        logging.info(f"PDFs: {len(changed)} new or changed, {len(unchanged)} unchanged, {len(removed)} removed")
 
-        # get docs, ids, and filenames (for metadata purposes)
-        docs = text_splitter.split_documents(docs)
-        ids = [str(uuid.uuid4()) for _ in range(len(docs))]
+        if not manifest.exists:
+            # chunks ingested before the manifest existed have random ids that no
+            # manifest entry knows about, start the collection over so they don't linger
+            await self.delete_untracked_chunks(collection_name)
 
-        # remove the file path and extension from the source
-        filenames = [doc.metadata['source'].split('/')[-1].split('.')[0] for doc in docs]
+        # purge the chunks of files that are gone or about to be replaced
+        for path in removed:
+            await self.delete_from_db(collection_name, manifest.chunk_ids(path))
+            manifest.remove(path)
+
+        for file_info in changed:
+            await self.delete_from_db(collection_name, manifest.chunk_ids(file_info['path']))
+
+        summary = {"loaded": 0, "unchanged": len(unchanged), "removed": len(removed), "chunks": 0}
+        if not changed:
+            await asyncio.to_thread(manifest.save)
+            return summary
 
         # get the hyperlinks for the pdfs with filenames
         hyperlinks_file = f"{file_path}/../hyperlinks.csv"
-        urls = read_hyperlinks(hyperlinks_file)
-        matched_urls = match_filenames_to_urls(filenames, urls)
+        urls = await asyncio.to_thread(read_hyperlinks, hyperlinks_file)
+
+        stats = {stage: {"items": 0, "seconds": 0.0} for stage in ("parse", "embed", "upsert")}
+        embed_queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+        upsert_queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+
+        # parsing and splitting is the CPU heavy part, spread it over a process pool
+        # when more than one worker is configured, otherwise use a single thread
+        loop = asyncio.get_running_loop()
+        pool = None
+        if INGEST_WORKERS > 1:
+            pool = ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=multiprocessing.get_context("spawn"))
 
-        for filename, url in matched_urls.items():
-            print(f"{filename}: {url}")
+        async def parse_stage():
+            # keep a window of files in flight but consume them in submission
+            # order so the output (and the chunk ids) stay deterministic
+            window = max(INGEST_WORKERS, 1) * 2
+            pending = deque()
+            files = iter(changed)
 
-        # save the docs in the collection with collection_name
-        collection = self.client.get_or_create_collection(collection_name)
+            def submit():
+                file_info = next(files, None)
+                if file_info is None:
+                    return False
+                pending.append((file_info, time.perf_counter(), loop.run_in_executor(pool, load_and_split, file_info['path'])))
+                return True
 
-        data_to_save = []
-        for doc, id, filename in zip(docs, ids, filenames):
+            while len(pending) < window and submit():
+                pass
+
+            while pending:
+                file_info, start, future = pending.popleft()
+                try:
+                    raw_chunks = await future
+                except Exception as e:
+                    logging.error(f"crudChroma.py: Error with loading {file_info['path']}: {e}")
+                    submit()
+                    continue
+                submit()
+
+                chunks = self._prepare_chunks(raw_chunks, urls, collection_name)
+                stats["parse"]["seconds"] += time.perf_counter() - start
+                stats["parse"]["items"] += len(chunks)
+
+                # the last batch of a file carries its chunk ids for the manifest
+                chunk_ids = [chunk['metadata']['id'] for chunk in chunks]
+                batches = list(chunk_list(chunks, INGEST_BATCH_SIZE)) or [[]]
+                for i, batch in enumerate(batches):
+                    done = (file_info, chunk_ids) if i == len(batches) - 1 else None
+                    await embed_queue.put((batch, done))
+            await embed_queue.put(None)
+
+        async def embed_stage():
+            while (item := await embed_queue.get()) is not None:
+                batch, done = item
+                start = time.perf_counter()
+                embeddings = await generate_embeddings([chunk.pop('text') for chunk in batch])
+                for chunk, embedding in zip(batch, embeddings):
+                    chunk['embedding'] = embedding
+                stats["embed"]["seconds"] += time.perf_counter() - start
+                stats["embed"]["items"] += len(batch)
+                await upsert_queue.put((batch, done))
+            await upsert_queue.put(None)
+
+        async def upsert_stage():
+            while (item := await upsert_queue.get()) is not None:
+                batch, done = item
+                start = time.perf_counter()
+                await self.save_to_db(batch)
+                stats["upsert"]["seconds"] += time.perf_counter() - start
+                stats["upsert"]["items"] += len(batch)
+
+                # only record a file once all its chunks are in the database
+                if done:
+                    manifest.update(*done)
+                    await asyncio.to_thread(manifest.save)
+                    summary["loaded"] += 1
+                    summary["chunks"] += len(done[1])
+
+        tasks = [asyncio.create_task(stage()) for stage in (parse_stage, embed_stage, upsert_stage)]
+        try:
+            await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            if pool:
+                # don't block the event loop on parses still running after an error or cancellation,
+                # the workers exit once their current file is done
+                pool.shutdown(wait=False, cancel_futures=True)
+            await asyncio.to_thread(manifest.save)
+
+        for stage, stage_stats in stats.items():
+            rate = stage_stats["items"] / stage_stats["seconds"] if stage_stats["seconds"] else 0.0
+            stage_stats["per_second"] = round(rate, 2)
+            stage_stats["seconds"] = round(stage_stats["seconds"], 3)
+            logging.info(f"Ingestion stage {stage}: {stage_stats}")
+
+        summary["stages"] = stats
+        return summary
+
+    def _prepare_chunks(self, raw_chunks, urls, collection_name):
+        """Turns the chunks of one file into the items for save_to_db"""
+        docs = [Document(page_content=chunk['page_content'], metadata=chunk['metadata']) for chunk in raw_chunks]
+
+        # remove the file path and extension from the source
+        filenames = [doc.metadata['source'].split('/')[-1].split('.')[0] for doc in docs]
+        matched_urls = match_filenames_to_urls(set(filenames), urls)
+
+        chunks = []
+        for i, (doc, filename) in enumerate(zip(docs, filenames)):
             url, text = matched_urls.get(filename, (None, "Description not found"))
-            combined_text = f"{text} {doc.page_content}"
-            # print the first 50 characters of the combined text
-            print(f"Combined text: {combined_text[:50]}...")
-            embedding = await generate_embedding(combined_text)
+            id = make_chunk_id(os.path.basename(doc.metadata['source']), doc.metadata.get('start_index', i))
             
             # Format the filename
             filename = urllib.parse.unquote(filename.replace('_', ' '))
@@ -122,20 +457,17 @@ class CRUD():
             else:
                 source = filename
             
-            # Prepare the metadata for saving
-            metadata = {
-                "id": id,
-                "source": source
-            }
-
-            # Add to data to be saved
-            data_to_save.append({
+            chunks.append({
                 "collection_name": collection_name,
                 "document": doc,
-                "embedding": embedding,
-                "metadata": metadata
+                "text": f"{text} {doc.page_content}",
+                # Prepare the metadata for saving
+                "metadata": {
+                    "id": id,
+                    "source": source,
+                    # lets the context builder merge overlapping chunks
+                    "start_index": doc.metadata.get('start_index', -1)
+                }
             })
 
-        return data_to_save
-
-
+        return chunks
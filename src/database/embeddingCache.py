@@ -0,0 +1,119 @@
+# embeddingCache.py
+import hashlib, logging, os, sqlite3, threading, time
+import numpy as np
+from collections import OrderedDict
+
+class EmbeddingCache:
+    """Content-addressed embedding cache with an in-memory LRU tier and a SQLite tier on disk"""
+    def __init__(self, path, memory_size=10000, disk_size=500000):
+        self.path = path
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.memory = OrderedDict()
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, embedding BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)")
+        self.conn.commit()
+        # counted once here, then kept up to date on insert and evict
+        self.disk_count = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, text):
+        return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, embedding):
+        self.memory[key] = embedding
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """Returns {key: embedding} for the keys found in either tier"""
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+                    self.hits["memory"] += 1
+                else:
+                    missing.append(key)
+
+            if missing:
+                # query in slices to stay under SQLite's host parameter limit
+                for i in range(0, len(missing), 500):
+                    part = missing[i:i + 500]
+                    rows = self.conn.execute(
+                        f"SELECT key, embedding FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                        part
+                    ).fetchall()
+                    for key, blob in rows:
+                        embedding = np.frombuffer(blob, dtype=np.float32).tolist()
+                        found[key] = embedding
+                        self._remember(key, embedding)
+                        self.hits["disk"] += 1
+
+                disk_hits = [key for key in missing if key in found]
+                if disk_hits:
+                    now = time.time()
+                    self.conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                        [(now, key) for key in disk_hits]
+                    )
+                    self.conn.commit()
+
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Stores {key: embedding} in both tiers and evicts the least recently used rows"""
+        if not items:
+            return
+
+        now = time.time()
+        with self._lock:
+            for key, embedding in items.items():
+                self._remember(key, embedding)
+
+            # replaced rows don't change the row count, only new keys do
+            keys = list(items)
+            existing = 0
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                existing += self.conn.execute(
+                    f"SELECT COUNT(*) FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchone()[0]
+
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, embedding, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(embedding, dtype=np.float32).tobytes(), now) for key, embedding in items.items()]
+            )
+            self.disk_count += len(keys) - existing
+            if self.disk_count > self.disk_size:
+                evicted = self.conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (self.disk_count - self.disk_size,)
+                ).rowcount
+                self.disk_count -= evicted
+                logging.info(f"Evicted {evicted} embeddings from the disk cache")
+            self.conn.commit()
+
+    def stats(self):
+        total = self.hits["memory"] + self.hits["disk"] + self.misses
+        return {
+            "memory_hits": self.hits["memory"],
+            "disk_hits": self.hits["disk"],
+            "misses": self.misses,
+            "hit_rate": round((total - self.misses) / total, 3) if total else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_entries": self.disk_count,
+        }
@@ -0,0 +1,69 @@
+# ingestManifest.py
+import hashlib, json, os, glob
+
+def file_hash(path, block_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def make_chunk_id(source, offset):
+    """Deterministic chunk id so re-ingesting a file overwrites instead of duplicating"""
+    return hashlib.sha256(f"{source}:{offset}".encode('utf-8')).hexdigest()[:32]
+
+# Keeps track of the ingested files of a collection
+# {path: {"size", "mtime", "hash", "chunk_ids"}}
+class IngestManifest:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        # False on the first ingest with a manifest, the collection may hold untracked chunks
+        self.exists = os.path.exists(path)
+        if self.exists:
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+
+    def diff(self, folder, pattern="*.pdf"):
+        """Splits the files in folder into (changed, unchanged, removed) against the manifest"""
+        changed, unchanged = [], []
+        paths = sorted(glob.glob(os.path.join(folder, pattern)))
+        for path in paths:
+            stat = os.stat(path)
+            entry = self.entries.get(path)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                unchanged.append(path)
+                continue
+
+            # size or mtime moved, only the content hash decides if it really changed
+            digest = file_hash(path)
+            if entry and entry['hash'] == digest:
+                entry['mtime'] = stat.st_mtime
+                unchanged.append(path)
+            else:
+                changed.append({
+                    "path": path,
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "hash": digest
+                })
+
+        existing = set(paths)
+        removed = [path for path in self.entries if path not in existing]
+        return changed, unchanged, removed
+
+    def chunk_ids(self, path):
+        return self.entries.get(path, {}).get('chunk_ids', [])
+
+    def update(self, file_info, chunk_ids):
+        self.entries[file_info['path']] = dict(file_info, chunk_ids=chunk_ids)
+
+    def remove(self, path):
+        self.entries.pop(path, None)
+
+    def save(self):
+        # write to a temp file first so a crash never leaves a half written manifest
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=4)
+        os.replace(tmp_path, self.path)
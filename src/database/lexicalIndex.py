@@ -0,0 +1,145 @@
+# lexicalIndex.py
+import asyncio, heapq, logging, math, re, threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# numbered course items: "Lab 7", "Benchmark 1", "HW #3", "Quiz 2", ...
+COURSE_TERMS = (
+    "lab", "labs", "benchmark", "hw", "homework", "assignment", "quiz", "exam",
+    "midterm", "lecture", "project", "milestone", "pset"
+)
+EXACT_TERM_PATTERN = re.compile(r'\b(?:' + '|'.join(COURSE_TERMS) + r')\s*#?\d+\b', re.IGNORECASE)
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuses several ranked id lists, returns [(id, score)] best first"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, id in enumerate(ranking):
+            scores[id] += 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+class BM25Index:
+    """Incremental BM25 inverted index over the documents of one collection"""
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)   # term -> {doc_id: term frequency}
+        self.doc_terms = {}                 # doc_id -> Counter of terms
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def add(self, doc_id, tokens):
+        self.remove(doc_id)
+        counts = Counter(tokens)
+        self.doc_terms[doc_id] = counts
+        self.doc_lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+        for term, tf in counts.items():
+            self.postings[term][doc_id] = tf
+
+    def remove(self, doc_id):
+        counts = self.doc_terms.pop(doc_id, None)
+        if counts is None:
+            return
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        for term in counts:
+            docs = self.postings[term]
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+
+    def search(self, tokens, top_k=10):
+        n = len(self.doc_terms)
+        if not n:
+            return []
+
+        avg_length = self.total_length / n or 1.0
+        scores = defaultdict(float)
+        for term in set(tokens):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+class LexicalIndex:
+    """
+    Keeps a BM25 index per collection in sync with CRUD writes. Collections are loaded
+    from chroma on first search, after that every upsert/delete is applied incrementally.
+    """
+    def __init__(self, tokenize, fastpath_max_tokens=6):
+        self.tokenize = tokenize
+        self.fastpath_max_tokens = fastpath_max_tokens
+        self.indexes = {}
+        self.loading = {}
+        self._lock = threading.Lock()
+        # a single worker applies writes in the order they happened
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bm25")
+
+    def on_write(self, collection_name, event):
+        if collection_name not in self.indexes and collection_name not in self.loading:
+            # not loaded yet, the first search reads the collection from chroma
+            return
+        asyncio.get_running_loop().run_in_executor(self.writer, self._apply, collection_name, event)
+
+    def _apply(self, collection_name, event):
+        tokenized = [self.tokenize(document or "") for document in event.get('documents') or []]
+        with self._lock:
+            index = self.indexes.get(collection_name)
+            if index is None:
+                return
+            if event['op'] == 'drop':
+                del self.indexes[collection_name]
+            elif event['op'] == 'delete':
+                for doc_id in event['ids']:
+                    index.remove(doc_id)
+            else:
+                for doc_id, tokens in zip(event['ids'], tokenized):
+                    index.add(doc_id, tokens)
+
+    async def ensure_loaded(self, collection_name, fetch):
+        """
+        Builds the index of a collection from fetch() -> collection.get() result. The load
+        runs on the writer, so writes notified meanwhile are applied after the snapshot.
+        """
+        if collection_name in self.indexes:
+            return
+        future = self.loading.get(collection_name)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.writer, self._load, collection_name, fetch)
+            self.loading[collection_name] = future
+            future.add_done_callback(lambda _: self.loading.pop(collection_name, None))
+        await asyncio.shield(future)
+
+    def _load(self, collection_name, fetch):
+        results = fetch()
+        ids, documents = results['ids'], results['documents']
+        index = BM25Index()
+        for doc_id, document in zip(ids, documents):
+            index.add(doc_id, self.tokenize(document or ""))
+        with self._lock:
+            self.indexes[collection_name] = index
+        logging.info(f"Built BM25 index for {collection_name} with {len(ids)} documents")
+
+    def search(self, collection_name, query, top_k=10):
+        tokens = self.tokenize(query)
+        with self._lock:
+            index = self.indexes.get(collection_name)
+            return index.search(tokens, top_k) if index else []
+
+    def is_exact_term_query(self, query):
+        """
+        Short queries dominated by exact course terms ("Lab 7", "when is HW 3 due?") can skip the
+        embedding call: the course terms must be more than half of the query's tokens, so
+        "I feel so stressed about exam 2" is still routed on its meaning
+        """
+        terms = EXACT_TERM_PATTERN.findall(query)
+        if not terms:
+            return False
+        term_tokens = len(self.tokenize(" ".join(terms)))
+        other_tokens = len(self.tokenize(EXACT_TERM_PATTERN.sub(" ", query)))
+        return term_tokens + other_tokens <= self.fastpath_max_tokens and term_tokens > other_tokens
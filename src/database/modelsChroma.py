@@ -1,26 +1,162 @@
 # modelsChroma.py
-import asyncio
+import asyncio, logging, threading, time
+from abc import ABC, abstractmethod
 from langchain.schema import Document
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
 
+from database.embeddingCache import EmbeddingCache
+from utlis.processMemory import current_rss_mb, rss_delta_mb
+from utlis.config import (
+    EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_TOKENS, EMBEDDING_CONCURRENCY, EMBEDDING_OPTION,
+    EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_DISK_SIZE
+)
+
+class EmbeddingRegistry:
+    """Builds each embedding backend once and keeps it warm for the whole process"""
+    MODELS = {
+        "openai": "text-embedding-ada-002",
+        "sentence-transformer": "all-MiniLM-L6-v2",
+    }
+
+    def __init__(self):
+        self._models = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(option):
+        return "openai" if option == "openai" else "sentence-transformer"
+
+    def _build(self, option):
+        if option == "openai":
+            return OpenAIEmbeddings(model=self.MODELS[option])
+        return SentenceTransformerEmbeddings(model_name=self.MODELS[option])
+
+    def get(self, option = EMBEDDING_OPTION):
+        option = self.normalize(option)
+        model = self._models.get(option)
+        if model is not None:
+            return model
+
+        # models can be requested from worker threads, only build each one once
+        with self._lock:
+            if option not in self._models:
+                # current RSS, not the peak (ru_maxrss), so an earlier peak doesn't hide the model
+                rss_before = current_rss_mb()
+                start = time.perf_counter()
+                self._models[option] = self._build(option)
+                load_time = time.perf_counter() - start
+                rss_after = current_rss_mb()
+
+                self._stats[option] = {
+                    "model": self.MODELS[option],
+                    "load_time_s": round(load_time, 3),
+                    "memory_mb": rss_delta_mb(rss_before, rss_after),
+                }
+                logging.info(f"Loaded embedding model {self._stats[option]}")
+
+        return self._models[option]
+
+    async def warm_up(self, *options):
+        for option in options or (EMBEDDING_OPTION,):
+            await asyncio.to_thread(self.get, option)
+
+    def stats(self):
+        return dict(self._stats)
+
+embedding_registry = EmbeddingRegistry()
+embedding_cache = EmbeddingCache(
+    EMBEDDING_CACHE_PATH,
+    memory_size=EMBEDDING_CACHE_SIZE,
+    disk_size=EMBEDDING_CACHE_DISK_SIZE
+)
+
 # embedding model options
-async def generate_embedding(text, option = "openai"):
-    if option == "openai":
-        embedding_model = OpenAIEmbeddings(model="text-embedding-ada-002")
-    else:
-        embedding_model = SentenceTransformerEmbeddings(model="all-MiniLM-L6-v2")
-    
-    return embedding_model.embed_query(text)
+async def generate_embedding(text, option = EMBEDDING_OPTION):
+    embeddings = await generate_embeddings([text], option)
+    return embeddings[0]
+
+def _estimate_tokens(text):
+    # rough estimate of ~4 characters per token, good enough for batch sizing
+    return len(text) // 4 + 1
+
+def _pack_batches(texts, max_items=EMBEDDING_BATCH_SIZE, max_tokens=EMBEDDING_BATCH_TOKENS):
+    """Groups text indices into batches bounded by item count and token count"""
+    batches, batch, batch_tokens = [], [], 0
+    for i, text in enumerate(texts):
+        tokens = _estimate_tokens(text)
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+async def generate_embeddings(texts, option = EMBEDDING_OPTION):
+    """Embeds a list of texts with as few requests as possible, keeping input order"""
+    texts = [str(text) for text in texts]
+    if not texts:
+        return []
+
+    # look up the cache first, only texts never seen before reach the model
+    model_name = embedding_registry.MODELS[embedding_registry.normalize(option)]
+    keys = [embedding_cache.make_key(model_name, text) for text in texts]
+    cached = await asyncio.to_thread(embedding_cache.get_many, list(set(keys)))
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in cached:
+            missing.setdefault(key, text)
+
+    if missing:
+        missing_keys, missing_texts = list(missing.keys()), list(missing.values())
+        embedding_model = embedding_registry.get(option)
+        semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+        async def embed_batch(batch):
+            async with semaphore:
+                return await asyncio.to_thread(embedding_model.embed_documents, [missing_texts[i] for i in batch])
+
+        batches = _pack_batches(missing_texts)
+        results = await asyncio.gather(*[embed_batch(batch) for batch in batches])
+
+        new_embeddings = {}
+        for batch, batch_embeddings in zip(batches, results):
+            for i, embedding in zip(batch, batch_embeddings):
+                new_embeddings[missing_keys[i]] = embedding
+
+        await asyncio.to_thread(embedding_cache.put_many, new_embeddings)
+        cached.update(new_embeddings)
+
+    return [cached[key] for key in keys]
+
+async def to_documents(infos, option = EMBEDDING_OPTION):
+    """Converts a list of info objects to (document, embedding) pairs in one batched embedding pass"""
+    documents = [info.document() for info in infos]
+    embeddings = await generate_embeddings([doc.page_content for doc in documents], option)
+    return list(zip(documents, embeddings))
 
 '''
 1. Consider using text-embedding-3-large as an embedding alternative
 2. Note that metadata has to be either type str, int, float, or bool to be added to the document
 '''
 
+# Base class for the models below, subclasses build their Document in document()
+class ChromaModel(ABC):
+    @abstractmethod
+    def document(self):
+        """Langchain Document (text + metadata with an 'id') stored for this model"""
+
+    async def to_document(self):
+        return (await to_documents([self]))[0]
+
 # Store the general information for a guild (server)
 # collection name: guild_info
-class GuildInfo:
+class GuildInfo(ChromaModel):
     def __init__(self, data):
         self.guild_id = data['guild_id']
         self.guild_name = data['guild_name']   
@@ -29,8 +165,7 @@ class GuildInfo:
         self.number_of_members = data['number_of_members']
         self.profanity_score = data["profanity_score"]
 
-    async def to_document(self):
-        embedding = await generate_embedding(self.guild_purpose)
+    def document(self):
         return Document(
             page_content=self.guild_purpose, 
             metadata={
@@ -40,11 +175,11 @@ class GuildInfo:
                 'number_of_members': self.number_of_members,
                 'profanity_score': self.profanity_score
             }
-        ), embedding
+        )
 
 # Store the general information for a channel
 # collection name: channel_info_{guild_id}
-class ChannelInfo:
+class ChannelInfo(ChromaModel):
     def __init__(self, data):
         self.channel_id = data['channel_id']
         self.guild_id = data['guild_id']
@@ -56,8 +191,7 @@ class ChannelInfo:
         self.first_message_timestamp = data['first_message_timestamp']
         self.profanity_score = data.get('profanity_score', 0)
 
-    async def to_document(self):
-        embedding = await generate_embedding(self.channel_purpose)
+    def document(self):
         return Document(
             page_content=self.channel_purpose, 
             metadata={
@@ -70,11 +204,11 @@ class ChannelInfo:
                 'first_message_timestamp': self.first_message_timestamp,
                 'profanity_score': self.profanity_score
             }
-        ), embedding
+        )
 
 # Store the general information for a member in a channel
 # collection name: member_info_{channel_id}
-class MemberInfoChannel:
+class MemberInfoChannel(ChromaModel):
     def __init__(self, data):
         self.user_id = data['user_id']
         self.channel_id = data['channel_id']
@@ -84,8 +218,7 @@ class MemberInfoChannel:
         self.message_sent = data['message_sent']
         self.profanity_score = data.get('profanity_score', 0)
 
-    async def to_document(self):
-        embedding = await generate_embedding(self.user_description)
+    def document(self):
         return Document(
             page_content=self.user_description, 
             metadata={
@@ -96,22 +229,21 @@ class MemberInfoChannel:
                 'message_sent': self.message_sent,
                 'profanity_score': self.profanity_score
             }
-        ), embedding
+        )
 
 
 # Store the list of channels a member is in, links to ChannelInfo
 # collection name: channel_list_{guild_id}
-class ChannelList:
+class ChannelList(ChromaModel):
     def __init__(self, data):
         self.user_id = data['user_id']   
         self.user_name = data['user_name']
         self.guild_id = data['guild_id']
         self.channel_ids = data['channel_ids']
 
-    async def to_document(self):
+    def document(self):
         # convert list to string
         content = str(self.user_id) + "_" + self.user_name
-        embedding = await generate_embedding(content)
         return Document(
             page_content= content, 
             metadata={
@@ -120,11 +252,11 @@ class ChannelList:
                 'guild_id': self.guild_id,
                 'channel_ids': str(self.channel_ids)
             }
-        ), embedding
+        )
 
 # Stores the chat history for each channel id
 # collection name: chat_history_{channel_id}
-class ChatHistory:
+class ChatHistory(ChromaModel):
     def __init__(self, data):
         self.message_id = data['message_id']
         self.content = data['content']
@@ -134,8 +266,7 @@ class ChatHistory:
         self.timestamp = data['timestamp']
         self.profanity_score = data.get('profanity_score', 0.0)
 
-    async def to_document(self):
-        embedding = await generate_embedding(self.content)
+    def document(self):
         return Document(
             page_content=self.content, 
             metadata={
@@ -145,4 +276,4 @@ class ChatHistory:
                 'timestamp': self.timestamp,
                 'profanity_score': self.profanity_score
             }
-        ), embedding
+        )
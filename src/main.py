@@ -1,34 +1,36 @@
-import asyncio, uvicorn, sys, os, discord, subprocess
-from discord.ext import commands
-from community_apps.getMessageDiscord import DiscordBot
-from backend.app import app as fastapi_app
-
-from utlis.config import DISCORD_TOKEN
-
-
-# temp
-from database.crudChroma import CRUD
+import asyncio, sys, os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
-# Define bot and command prefix
-'''could use Intents.all() instead of Intents.default()'''
-intents = discord.Intents.default()
-intents.members = True
-intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
-
-# Initialize your Discord bot class 
-discord_bot = DiscordBot(bot)
+# The app, the bot and the database are only imported by the run functions: PDF ingestion
+# spawns worker processes that re-import this module, and they must not open the
+# chroma store, the caches or the bot a second time.
 
 # Function to run FastAPI server
 async def run_fastapi():
+    import uvicorn
+    from backend.app import app as fastapi_app
+
     config = uvicorn.Config(fastapi_app, host="0.0.0.0", port=8000, log_level="info", reload=True)
     server = uvicorn.Server(config)
     await server.serve()
 
 # Function to run the Discord bot
 async def run_discord_bot():
+    import discord
+    from discord.ext import commands
+    from community_apps.getMessageDiscord import DiscordBot
+    from utlis.config import DISCORD_TOKEN
+
+    # Define bot and command prefix
+    '''could use Intents.all() instead of Intents.default()'''
+    intents = discord.Intents.default()
+    intents.members = True
+    intents.message_content = True
+    bot = commands.Bot(command_prefix="!", intents=intents)
+
+    # Initialize your Discord bot class 
+    discord_bot = DiscordBot(bot)
     await bot.start(DISCORD_TOKEN)
 
 # Main function to run both FastAPI and Discord bot concurrently
@@ -50,6 +52,7 @@ if __name__ == "__main__":
 
 # async def load_pdfs():
 #     # print current working directory
+#     from database.crudChroma import CRUD
 #     crud = CRUD()
 #     await crud.save_pdfs("./src/services/pdf_files", "course_materials")
 
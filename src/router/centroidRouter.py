@@ -0,0 +1,45 @@
+# centroidRouter.py
+import numpy as np
+
+def normalize_rows(matrix):
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class CentroidRouter:
+    """
+    In-process router: every route is represented by the centroid of its utterance
+    embeddings plus the utterance vectors themselves, all stacked in one matrix.
+    A query is scored against every route with a single matmul, a route's score is
+    its best cosine similarity (centroid or utterance).
+    """
+    def __init__(self, route_embeddings, threshold=0.82, centroids=None):
+        self.routes = list(route_embeddings)
+        self.threshold = threshold
+
+        blocks, starts = [], []
+        for name in self.routes:
+            vectors = normalize_rows(route_embeddings[name])
+            centroid = centroids[name] if centroids is not None else vectors.mean(axis=0)
+            starts.append(sum(len(block) for block in blocks))
+            blocks.append(np.vstack([normalize_rows(centroid), vectors]))
+
+        self.matrix = np.ascontiguousarray(np.vstack(blocks))
+        # rows of each route are contiguous, reduceat takes the max per route
+        self.starts = np.array(starts)
+
+    def set_centroid(self, name, centroid):
+        """Replaces the centroid row of one route in place, O(dim)"""
+        self.matrix[self.starts[self.routes.index(name)]] = normalize_rows(centroid)[0]
+
+    def scores(self, embeddings):
+        """(n, dim) query embeddings -> (n, routes) route scores"""
+        similarities = normalize_rows(embeddings) @ self.matrix.T
+        return np.maximum.reduceat(similarities, self.starts, axis=1)
+
+    def __call__(self, embedding):
+        """Name of the best route for one query embedding, None when below threshold"""
+        scores = self.scores(embedding)[0]
+        best = int(np.argmax(scores))
+        return self.routes[best] if scores[best] >= self.threshold else None
@@ -0,0 +1,10 @@
+# experts.py
+# Expert -> group, the collection whose documents shape the expert's centroid and the
+# prompt answering from it. Experts without a collection are represented by their
+# utterances only and answer with their own response function.
+EXPERTS = {
+    "progress_report": {"group": "course", "collection": None, "prompt": None},
+    "problem_solve": {"group": "course", "collection": None, "prompt": None},
+    "material_info": {"group": "course", "collection": "course_materials", "prompt": "course_instructor"},
+    "mental_support": {"group": "health", "collection": None, "prompt": None},
+}
@@ -0,0 +1,153 @@
+# hierarchicalRouter.py
+import logging
+import numpy as np
+
+from router.centroidRouter import CentroidRouter, normalize_rows
+
+class RunningCentroid:
+    """Running mean of a set of vectors, adding vectors costs O(dim) each"""
+    def __init__(self, vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float64))
+        self.sum = vectors.sum(axis=0)
+        self.count = len(vectors)
+
+    def add(self, vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float64))
+        self.sum += vectors.sum(axis=0)
+        self.count += len(vectors)
+
+    @property
+    def mean(self):
+        return self.sum / max(self.count, 1)
+
+class HierarchicalRouter:
+    """
+    Two-tier group -> expert router. The group tier is one matmul against a row per group
+    (the mean of its experts' centroids), the expert tier is a CentroidRouter per group.
+    Expert centroids start from the expert's utterances and follow the documents written
+    to its collection as a running mean, so new documents change routing immediately.
+    """
+    def __init__(self, experts, route_embeddings, threshold=0.82):
+        self.experts = experts
+        self.threshold = threshold
+        self.groups = sorted({expert['group'] for expert in experts.values()})
+        self.group_experts = {
+            group: [name for name, expert in experts.items() if expert['group'] == group]
+            for group in self.groups
+        }
+        # columns of expert_scores: the experts of every group, groups in order
+        self.expert_names = [name for group in self.groups for name in self.group_experts[group]]
+        self.group_columns = {
+            group: np.array([self.expert_names.index(name) for name in self.group_experts[group]])
+            for group in self.groups
+        }
+        self.utterances = {name: np.asarray(route_embeddings[name], dtype=np.float32) for name in experts}
+        self.reset_centroids()
+
+    def reset_centroids(self):
+        """Back to the utterance-only centroids, documents are added with add_documents"""
+        self.centroids = {name: RunningCentroid(self.utterances[name]) for name in self.experts}
+        self.seen_ids = {name: set() for name in self.experts}
+        self.expert_routers = {
+            group: CentroidRouter(
+                {name: self.utterances[name] for name in names},
+                threshold=self.threshold,
+                centroids={name: self.centroids[name].mean for name in names}
+            )
+            for group, names in self.group_experts.items()
+        }
+        self.group_matrix = np.vstack([self._group_centroid(group) for group in self.groups])
+
+    def reset_expert(self, expert):
+        """Drops the documents of one expert (after deletes), they are added again by the caller"""
+        self.centroids[expert] = RunningCentroid(self.utterances[expert])
+        self.seen_ids[expert] = set()
+        self._refresh(expert)
+
+    def _refresh(self, expert):
+        group = self.experts[expert]['group']
+        self.expert_routers[group].set_centroid(expert, self.centroids[expert].mean)
+        self.group_matrix[self.groups.index(group)] = self._group_centroid(group)
+
+    def _group_centroid(self, group):
+        names = self.group_experts[group]
+        return normalize_rows(np.mean([normalize_rows(self.centroids[name].mean)[0] for name in names], axis=0))[0]
+
+    def expert_for_collection(self, collection_name):
+        for name, expert in self.experts.items():
+            if expert['collection'] == collection_name:
+                return name
+        return None
+
+    def add_documents(self, expert, ids, embeddings):
+        """Folds new documents into the expert's centroid and refreshes its rows in place"""
+        seen = self.seen_ids[expert]
+        # re-upserted ids are already part of the mean
+        vectors = [embedding for id, embedding in zip(ids, embeddings) if id not in seen and embedding is not None]
+        seen.update(ids)
+        if not vectors:
+            return
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if vectors.shape[1] != self.group_matrix.shape[1]:
+            logging.error(f"Embedding size {vectors.shape[1]} of {expert} documents doesn't match the router")
+            return
+
+        self.centroids[expert].add(vectors)
+        self._refresh(expert)
+
+    def expert_scores(self, queries):
+        """(n, dim) normalized queries -> (n, experts) scores of every expert, columns as in expert_names"""
+        return np.hstack([self.expert_routers[group].scores(queries) for group in self.groups])
+
+    def _best_in_group(self, queries, scores):
+        """Column of the best expert of each query's best group, only those experts compete for the route"""
+        best_groups = np.argmax(queries @ self.group_matrix.T, axis=1)
+        in_group = np.zeros(scores.shape, dtype=bool)
+        for g, group in enumerate(self.groups):
+            in_group[np.ix_(best_groups == g, self.group_columns[group])] = True
+        return np.argmax(np.where(in_group, scores, -np.inf), axis=1)
+
+    def route(self, embeddings):
+        """
+        Routes (n, dim) query embeddings: best group first, then the best expert of that group.
+        Returns one (expert or None, score, margin to the runner-up expert of any group) per query,
+        the margin is negative when an expert of another group scores higher.
+        """
+        queries = normalize_rows(embeddings)
+        scores = self.expert_scores(queries)
+        best = self._best_in_group(queries, scores)
+        rows = np.arange(len(queries))
+        best_scores = scores[rows, best]
+
+        # the runner-up is the best of all the other experts, whatever their group
+        if scores.shape[1] > 1:
+            others = scores.copy()
+            others[rows, best] = -np.inf
+            margins = best_scores - others.max(axis=1)
+        else:
+            margins = best_scores
+        return [
+            (self.expert_names[expert] if score >= self.threshold else None, score, margin)
+            for expert, score, margin in zip(best.tolist(), best_scores.tolist(), margins.tolist())
+        ]
+
+    def rank(self, embedding):
+        """
+        Every expert for one query embedding: the expert route() picks (best expert of the best
+        group) first, then the others by score whatever their group. Returns (expert, score,
+        margin to the next one), so the first margin is the same as route()'s.
+        """
+        query = normalize_rows(embedding)
+        scores = self.expert_scores(query)
+        best = int(self._best_in_group(query, scores)[0])
+        scores = scores[0]
+        others = [i for i in np.argsort(-scores) if i != best]
+        ranked = [(self.expert_names[i], float(scores[i])) for i in [best] + others]
+
+        return [
+            (expert, score, score - ranked[i + 1][1] if i + 1 < len(ranked) else score)
+            for i, (expert, score) in enumerate(ranked)
+        ]
+
+    def __call__(self, embedding):
+        return self.route(embedding)[0][0]
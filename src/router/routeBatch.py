@@ -0,0 +1,47 @@
+# routeBatch.py
+# Offline batch routing, e.g. to classify historical chat messages by route for analytics
+# or to seed expert collections.
+#
+# Usage: python src/router/routeBatch.py --collection chat_history_<channel_id> --output routes.json
+#        python src/router/routeBatch.py --input queries.txt   (one query per line)
+import asyncio, json, os, sys, time
+from collections import Counter
+import fire
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from database.crudChroma import CRUD
+from router.semanticRouter import create_router
+
+async def run(input, collection):
+    crud = CRUD()
+    router = create_router(crud)
+    # build the index up front so the timing below is routing only
+    await router.get_route_index()
+
+    start = time.perf_counter()
+    if collection:
+        routes = await router.route_collection(collection)
+    else:
+        with open(input) as f:
+            queries = [line.strip() for line in f if line.strip()]
+        routes = [dict(route, query=query) for query, route in zip(queries, await router.route_batch(queries=queries))]
+    elapsed = time.perf_counter() - start
+
+    print(f"Routed {len(routes)} queries in {elapsed:.3f}s ({len(routes) / elapsed if elapsed else 0:.0f} queries/s)")
+    return routes
+
+def main(input: str = None, collection: str = None, output: str = None):
+    if not input and not collection:
+        raise ValueError("Pass --input <file> or --collection <name>")
+
+    routes = asyncio.run(run(input, collection))
+    for route, count in Counter(route['route'] or "fallback" for route in routes).most_common():
+        print(f"{route:<20} {count}")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(routes, f, indent=4)
+        print(f"Routes saved to {output}")
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,69 @@
+# routeIndexStore.py
+import asyncio, hashlib, json, logging, os
+import numpy as np
+
+def content_hash(model, texts):
+    digest = hashlib.sha256(model.encode('utf-8'))
+    for text in texts:
+        digest.update(b"\0" + text.encode('utf-8'))
+    return digest.hexdigest()
+
+class RouteIndexStore:
+    """
+    Persists the utterance embeddings of the router next to the database: a float32 .npy
+    matrix (memory mapped on load) and a .json manifest with the encoder model, the hash
+    of the whole utterance set and the hash of every row. An unchanged utterance set loads
+    without any network call, otherwise only the added or changed utterances are encoded.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.matrix_path = f"{path}.npy"
+        self.manifest_path = f"{path}.json"
+
+    def _read(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            matrix = np.load(self.matrix_path, mmap_mode='r')
+            if len(manifest.get('rows', [])) != len(matrix):
+                return None, None
+            return manifest, matrix
+        except (OSError, ValueError) as e:
+            logging.info(f"No usable route index at {self.path}: {e}")
+            return None, None
+
+    def _write(self, manifest, matrix):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # write to temporary files and swap them in, a crash never leaves a half written index
+        with open(f"{self.matrix_path}.tmp", 'wb') as f:
+            np.save(f, matrix)
+        with open(f"{self.manifest_path}.tmp", 'w') as f:
+            json.dump(manifest, f)
+        os.replace(f"{self.matrix_path}.tmp", self.matrix_path)
+        os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+    async def load(self, texts, model, encode):
+        """(len(texts), dim) embeddings of texts, encode(list of texts) is awaited for the missing ones"""
+        set_hash = content_hash(model, texts)
+        manifest, matrix = await asyncio.to_thread(self._read)
+        if manifest and manifest.get('model') == model and manifest.get('hash') == set_hash:
+            logging.info(f"Loaded route index ({len(texts)} utterances) from {self.matrix_path}")
+            return matrix
+
+        row_hashes = [content_hash(model, [text]) for text in texts]
+        known = {}
+        if manifest and manifest.get('model') == model:
+            known = {row_hash: i for i, row_hash in enumerate(manifest['rows'])}
+
+        missing = [i for i, row_hash in enumerate(row_hashes) if row_hash not in known]
+        encoded = await encode([texts[i] for i in missing]) if missing else []
+        logging.info(f"Route index: {len(texts) - len(missing)} utterances reused, {len(missing)} encoded")
+
+        rows = dict(zip(missing, encoded))
+        updated = np.array([
+            rows[i] if i in rows else matrix[known[row_hash]]
+            for i, row_hash in enumerate(row_hashes)
+        ], dtype=np.float32)
+
+        await asyncio.to_thread(self._write, {'model': model, 'hash': set_hash, 'rows': row_hashes}, updated)
+        return updated
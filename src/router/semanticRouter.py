@@ -1,58 +1,47 @@
-from semantic_router import Route, RouteLayer
-from semantic_router.encoders import OpenAIEncoder
-import os, sys, logging, inspect 
+import os, sys, logging, inspect, asyncio
+import numpy as np
 
 # Adding path to ensure utils and backend are detected
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from utlis.config import OPENAI_API_KEY
+from utlis.config import (
+    OPENAI_API_KEY, CONTEXT_TOKEN_BUDGET, RERANK_CANDIDATES, ROUTE_SCORE_THRESHOLD,
+    EMBEDDING_OPTION, ROUTE_INDEX_PATH, ROUTE_FANOUT_MARGIN, ROUTE_FANOUT_TOP_N
+)
 from utlis.prompts import PROMPTS
 from backend.modelsPydantic import QueryRequest
-from database.modelsChroma import generate_embedding
-from services.queryLangchain import fetchGptResponse
+from database.modelsChroma import embedding_registry, generate_embedding, generate_embeddings
+from services.queryLangchain import fetchGptResponse, fetchGptResponseStream
+from services.contextBuilder import build_context, context_sources
+from services.reranker import reranker
+from router.hierarchicalRouter import HierarchicalRouter
+from router.routeIndexStore import RouteIndexStore
 from router.utterances import UTTERANCES
+from router.experts import EXPERTS
 
 # Logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# exact course term queries ("Lab 7", "HW 3") are lookups in the course materials
+LEXICAL_ROUTE = "material_info"
+
 class SemanticRouter:
-    def __init__(self, crud):
+    def __init__(self, crud, answer_cache=None):
         os.environ["OPENAI_API_KEY"] = OPENAI_API_KEY
         
         # Set up variables
         self.crud = crud
-        self.encoder = OpenAIEncoder()
+        self.answer_cache = answer_cache
+        self.expert_router = None
+        self.stale_experts = set()
+        self.pending_writes = None  # writes arriving while the route index is built, None otherwise
+        self.route_store = RouteIndexStore(ROUTE_INDEX_PATH)
+        self._index_lock = asyncio.Lock()
         self._setup_routes()
+        self.crud.add_write_listener(self.on_write)
         
     def _setup_routes(self):
-        """Initialize routes and route layer"""
-        # Route definitions and their utterances
-        self.progress_report_rt = Route(
-            name="progress_report",
-            utterances=UTTERANCES["progress_report"],
-        )
-
-        self.problem_solve_rt = Route(
-            name="problem_solve",
-            utterances=UTTERANCES["problem_solve"],
-        )
-
-        self.material_info_rt = Route(
-            name="material_info",
-            utterances=UTTERANCES["material_info"],
-        )
-
-        self.mental_support_rt = Route(
-            name="mental_support",
-            utterances=UTTERANCES["mental_support"],
-        )
-
-        # Define Route Layer
-        self.route_layer = RouteLayer(encoder=self.encoder, routes=[
-            self.progress_report_rt,
-            self.problem_solve_rt,
-            self.material_info_rt,
-            self.mental_support_rt,
-        ])
+        """Initialize routes, the route index is built on first use (see get_route_index)"""
+        self.route_names = list(UTTERANCES)
         
         # Setup response mapping
         self.route_responses = {
@@ -62,53 +51,289 @@ class SemanticRouter:
             "mental_support": self.mental_support_guidance,
             "fallback": self.fallback_response,
         }
-    
+
+        # Routes that can stream their answer, the others answer in one piece
+        self.route_streams = {
+            "material_info": self.material_info_stream,
+        }
+
+    async def get_route_index(self):
+        """Loads (or incrementally encodes) the utterance embeddings and builds the group -> expert router"""
+        if self.expert_router is None:
+            async with self._index_lock:
+                if self.expert_router is None:
+                    # a collection can be read before a concurrent write lands in it, so writes
+                    # during the build are queued and applied on top of the loaded documents
+                    self.pending_writes = []
+                    try:
+                        utterances = [utterance for name in self.route_names for utterance in UTTERANCES[name]]
+                        model = embedding_registry.MODELS[embedding_registry.normalize(EMBEDDING_OPTION)]
+                        embeddings = await self.route_store.load(utterances, model, generate_embeddings)
+
+                        route_embeddings, offset = {}, 0
+                        for name in self.route_names:
+                            route_embeddings[name] = embeddings[offset:offset + len(UTTERANCES[name])]
+                            offset += len(UTTERANCES[name])
+                        expert_router = HierarchicalRouter(EXPERTS, route_embeddings, threshold=ROUTE_SCORE_THRESHOLD)
+                        for expert in EXPERTS:
+                            await self._load_expert_documents(expert_router, expert)
+
+                        # documents that were already read are skipped by add_documents
+                        for collection_name, event in self.pending_writes:
+                            self._apply_write(expert_router, collection_name, event)
+                        self.expert_router = expert_router
+                    finally:
+                        self.pending_writes = None
+                    logging.info(f"Built route index with {len(utterances)} utterances")
+
+        if self.stale_experts:
+            async with self._index_lock:
+                while self.stale_experts:
+                    expert = self.stale_experts.pop()
+                    self.expert_router.reset_expert(expert)
+                    await self._load_expert_documents(self.expert_router, expert)
+        return self.expert_router
+
+    async def route_batch(self, queries=None, embeddings=None):
+        """
+        Routes many queries at once for offline classification and backfills. Queries are
+        embedded in batches (skipped when embeddings are given) and scored in one pass.
+        Returns one {'route', 'score', 'margin'} per query, route is None below the threshold.
+        """
+        if embeddings is None:
+            embeddings = await generate_embeddings(list(queries or []))
+        if not len(embeddings):
+            return []
+
+        expert_router = await self.get_route_index()
+        return [
+            {'route': route, 'score': score, 'margin': margin}
+            for route, score, margin in expert_router.route(np.asarray(embeddings, dtype=np.float32))
+        ]
+
+    async def route_collection(self, collection_name):
+        """Routes every document of a collection (e.g. chat_history_<channel_id>) with its stored embedding"""
+        collection = await self.crud.get_collection(collection_name)
+        results = await self.crud._run(collection.get, include=["documents", "embeddings"])
+        routes = await self.route_batch(embeddings=results['embeddings'])
+        return [
+            dict(route, id=id, document=document)
+            for id, document, route in zip(results['ids'], results['documents'], routes)
+        ]
+
+    async def _load_expert_documents(self, expert_router, expert):
+        """Adds the documents already in an expert's collection to its centroid"""
+        collection_name = EXPERTS[expert]['collection']
+        if not collection_name:
+            return
+        try:
+            collection = await self.crud.get_collection(collection_name)
+            results = await self.crud._run(collection.get, include=["embeddings"])
+        except Exception as e:
+            self.crud.collections.pop(collection_name, None)
+            logging.info(f"No documents for the {expert} centroid yet: {e}")
+            return
+        if len(results['ids']):
+            expert_router.add_documents(expert, results['ids'], results['embeddings'])
+        logging.info(f"Centroid of {expert} covers {expert_router.centroids[expert].count} vectors")
+
+    def on_write(self, collection_name, event):
+        """Keeps expert centroids current: upserts are folded in, deletes trigger a reload"""
+        if self.expert_router is None:
+            if self.pending_writes is not None:
+                self.pending_writes.append((collection_name, event))
+            # before the build starts, documents already written are loaded by it
+            return
+        self._apply_write(self.expert_router, collection_name, event)
+
+    def _apply_write(self, expert_router, collection_name, event):
+        expert = expert_router.expert_for_collection(collection_name)
+        if expert is None:
+            return
+        if event['op'] == 'upsert':
+            expert_router.add_documents(expert, event['ids'], event['embeddings'])
+        else:
+            self.stale_experts.add(expert)
+
+    async def rank_query(self, query):
+        """
+        Returns (ranking, query embedding or None), the query is embedded at most once. The ranking
+        lists (expert, score, margin to the next expert) best first. Exact course term queries skip
+        the embedding and go straight to BM25 retrieval in the course materials (LEXICAL_ROUTE),
+        their ranking is a single entry without score.
+        """
+        if self.is_lexical_query(query):
+            return [(LEXICAL_ROUTE, None, None)], None
+
+        query_embedding = await generate_embedding(query)
+        expert_router = await self.get_route_index()
+        return expert_router.rank(query_embedding), query_embedding
+
+    def select_route(self, ranking):
+        """Best route of a ranking, None (fallback) when its score is below the threshold"""
+        route_name, score, _ = ranking[0]
+        return route_name if score is None or score >= ROUTE_SCORE_THRESHOLD else None
+
+    def fanout_experts(self, ranking):
+        """
+        When the top two routes are closer than ROUTE_FANOUT_MARGIN, the experts among the top
+        ROUTE_FANOUT_TOP_N that have a collection, otherwise [] and the best route answers alone.
+        """
+        route_name, score, margin = ranking[0]
+        if score is None or score < ROUTE_SCORE_THRESHOLD or len(ranking) < 2 or margin >= ROUTE_FANOUT_MARGIN:
+            return []
+        return [name for name, _, _ in ranking[:ROUTE_FANOUT_TOP_N] if EXPERTS[name]['collection']]
+
+    def fanout_target(self, ranking):
+        """(collection name or names, prompt name) to answer an ambiguous query from, None for a single route"""
+        experts = self.fanout_experts(ranking)
+        if not experts:
+            return None
+        logging.info(f"Ambiguous route {ranking[:ROUTE_FANOUT_TOP_N]}, retrieving from {experts}")
+        collection_names = [EXPERTS[name]['collection'] for name in experts]
+        # a single collection goes through the regular (cached) path
+        return collection_names if len(collection_names) > 1 else collection_names[0], EXPERTS[experts[0]]['prompt']
+
     # Response functions
-    async def progress_report_guidance(self, request=None):
+    async def progress_report_guidance(self, request=None, query_embedding=None):
         return "Tracking your submitted labs and reviewing feedback will help ensure steady progress."
 
-    async def problem_solve_guidance(self, request=None):
+    async def problem_solve_guidance(self, request=None, query_embedding=None):
         return "Start by breaking the problem into smaller parts and focus on the key concepts."
 
-    async def material_info_guidance(self, request):
-        return await self.generate_expert_response(request, collection_name="course_materials", prompt_name="course_instructor")
+    async def material_info_guidance(self, request, query_embedding=None):
+        return await self.generate_expert_response(request, "course_materials", "course_instructor", query_embedding)
+
+    async def material_info_stream(self, request, query_embedding=None):
+        async for token in self.generate_expert_response_stream(request, "course_materials", "course_instructor", query_embedding):
+            yield token
 
-    async def mental_support_guidance(self, request=None):
+    async def mental_support_guidance(self, request=None, query_embedding=None):
         return "If you are feeling overwhelmed, NYU provides free counseling services to help students manage stress."
 
-    async def fallback_response(self, request=None):
+    async def fallback_response(self, request=None, query_embedding=None):
         return "I'm not sure I understood that. Could you rephrase or ask something more specific?"
         
-    async def generate_expert_response(self, request, collection_name, prompt_name):
-        """Generates response using LLM and relevant documents"""
-        query_embedding = await generate_embedding(request.query)
-        collection_name = collection_name
-        relevant_docs = await self.crud.get_data_by_similarity(collection_name, query_embedding, top_k=5)
-        
-        content = relevant_docs.get('documents')[0]
-        logging.info(f"Relevant messages: {content}")
+    async def retrieve_context(self, collection_name, query, query_embedding=None):
+        """
+        Retrieves the relevant documents (BM25 + vector) and packs their text into the prompt token budget.
+        A list of collections is searched concurrently and merged into one ranking. Returns (context, sources).
+        """
+        # with the reranker enabled, retrieve more candidates and let it keep the best few
+        top_k = RERANK_CANDIDATES if reranker.enabled else 5
+        if isinstance(collection_name, list):
+            relevant_docs = await self.crud.get_data_hybrid_multi(collection_name, query, query_embedding, top_k=top_k)
+        else:
+            relevant_docs = await self.crud.get_data_hybrid(collection_name, query, query_embedding, top_k=top_k)
+        relevant_docs = await reranker.rerank(query, relevant_docs)
+        context = build_context(relevant_docs, token_budget=CONTEXT_TOKEN_BUDGET)
+        logging.info(f"Relevant context: {context[:200]}...")
+        return context, context_sources(relevant_docs)
+
+    def is_lexical_query(self, query):
+        """Short queries on exact course terms ("Lab 7") are answered from BM25 alone, without embedding"""
+        lexical_index = self.crud.lexical_index
+        return lexical_index is not None and lexical_index.is_exact_term_query(query)
+
+    async def generate_expert_response(self, request, collection_name, prompt_name, query_embedding=None):
+        """Generates response using LLM and relevant documents, reusing the routing embedding if given"""
+        if query_embedding is None and self.is_lexical_query(request.query):
+            # no embedding means no answer cache lookup either
+            context, sources = await self.retrieve_context(collection_name, request.query)
+            answer = await fetchGptResponse(request.query, PROMPTS[prompt_name], context)
+            logging.info(f"Answer (lexical): {answer}")
+            return {'answer': answer, 'sources': sources}
+
+        if query_embedding is None:
+            query_embedding = await generate_embedding(request.query)
+
+        async def answer_query():
+            context, sources = await self.retrieve_context(collection_name, request.query, query_embedding)
+            answer = await fetchGptResponse(request.query, PROMPTS[prompt_name], context)
+            return {'answer': answer, 'sources': sources}
+
+        # answers from several collections aren't cached, the cache is invalidated per collection
+        if self.answer_cache and not isinstance(collection_name, list):
+            result = await self.answer_cache.get_or_compute(collection_name, query_embedding, answer_query)
+        else:
+            result = await answer_query()
+
+        logging.info(f"Answer: {result['answer']}")
+        return result
+
+    async def generate_expert_response_stream(self, request, collection_name, prompt_name, query_embedding=None):
+        """Streaming variant of generate_expert_response, yields the answer token by token"""
+        if query_embedding is None and self.is_lexical_query(request.query):
+            context, _ = await self.retrieve_context(collection_name, request.query)
+            async for token in fetchGptResponseStream(request.query, PROMPTS[prompt_name], context):
+                yield token
+            return
 
-        answer = await fetchGptResponse(request.query, PROMPTS[prompt_name], relevant_docs)
+        if query_embedding is None:
+            query_embedding = await generate_embedding(request.query)
 
-        logging.info(f"Answer: {answer}")
-        return {'answer': answer}
+        async def answer_query(sources):
+            context, found = await self.retrieve_context(collection_name, request.query, query_embedding)
+            sources.extend(found)
+            async for token in fetchGptResponseStream(request.query, PROMPTS[prompt_name], context):
+                yield token
+
+        if self.answer_cache and not isinstance(collection_name, list):
+            tokens = self.answer_cache.stream_or_compute(collection_name, query_embedding, answer_query)
+        else:
+            tokens = answer_query([])
+
+        async for token in tokens:
+            yield token
+
+    async def process_query_stream(self, request: QueryRequest):
+        """Streaming variant of process_query, yields the answer in pieces as it is generated"""
+        try:
+            ranking, query_embedding = await self.rank_query(request.query)
+            route_name = self.select_route(ranking)
+            logging.info(f"Processed route: {route_name}")
+
+            fanout = self.fanout_target(ranking)
+            if fanout:
+                collection_names, prompt_name = fanout
+                async for token in self.generate_expert_response_stream(request, collection_names, prompt_name, query_embedding):
+                    yield token
+                return
+
+            if route_name in self.route_streams:
+                async for token in self.route_streams[route_name](request, query_embedding):
+                    yield token
+                return
+
+            response_function = self.route_responses.get(route_name, self.fallback_response)
+            response = await response_function(request, query_embedding)
+            yield response.get('answer', '') if isinstance(response, dict) else str(response)
+
+        except Exception as e:
+            logging.error(f"Error processing query: {request.query} | Error: {e}")
+            yield "I'm sorry, something went wrong while answering that question."
 
     async def process_query(self, request: QueryRequest):
         """Main entry point to process a query through the semantic router"""
         try:
-            route = self.route_layer(request.query)
+            ranking, query_embedding = await self.rank_query(request.query)
+            route_name = self.select_route(ranking)
 
             # Log the processed route details
-            logging.info(f"Processed route: {route}")
+            logging.info(f"Processed route: {route_name}")
 
-            if hasattr(route, 'name') and route.name:
-                response_function = self.route_responses.get(route.name, self.fallback_response)
+            fanout = self.fanout_target(ranking)
+            if fanout:
+                collection_names, prompt_name = fanout
+                response = await self.generate_expert_response(request, collection_names, prompt_name, query_embedding)
+            elif route_name:
+                response_function = self.route_responses.get(route_name, self.fallback_response)
 
                 # Handle async and non-async functions
                 if inspect.iscoroutinefunction(response_function):
-                    response = await response_function(request)
+                    response = await response_function(request, query_embedding)
                 else:
-                    response = response_function(request)
+                    response = response_function(request, query_embedding)
             else:
                 response = await self.fallback_response(request)
 
@@ -128,5 +353,5 @@ class SemanticRouter:
             return {"error": str(e)} 
 
 # Factory function to create router instance
-def create_router(crud):
-    return SemanticRouter(crud)
\ No newline at end of file
+def create_router(crud, answer_cache=None):
+    return SemanticRouter(crud, answer_cache)
\ No newline at end of file
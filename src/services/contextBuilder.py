@@ -0,0 +1,116 @@
+# contextBuilder.py
+import re
+import tiktoken
+from functools import lru_cache
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model="gpt-3.5-turbo"):
+    return tiktoken.encoding_for_model(model)
+
+def _shingles(text, size=3):
+    words = re.findall(r'\w+', text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+def _text_overlap(first, second, min_overlap=20):
+    """Length of the longest suffix of first that is a prefix of second"""
+    for size in range(min(len(first), len(second)), min_overlap - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+def _merge_source(chunks):
+    """Merges overlapping or adjacent chunks of one source, keeping the best distance"""
+    # chunks with an offset can be merged by position, the others only by text overlap
+    chunks = sorted(chunks, key=lambda chunk: (chunk['start'] is None, chunk['start'] or 0))
+    merged = []
+    for chunk in chunks:
+        if merged:
+            last = merged[-1]
+            if last['start'] is not None and chunk['start'] is not None:
+                last_end = last['start'] + len(last['text'])
+                if chunk['start'] <= last_end:
+                    last['text'] += chunk['text'][last_end - chunk['start']:]
+                    last['distance'] = min(last['distance'], chunk['distance'])
+                    continue
+            else:
+                overlap = _text_overlap(last['text'], chunk['text'])
+                if overlap:
+                    last['text'] += chunk['text'][overlap:]
+                    last['distance'] = min(last['distance'], chunk['distance'])
+                    continue
+        merged.append(dict(chunk))
+    return merged
+
+def context_sources(results, source_key='source'):
+    """Distinct sources of a chroma query result in order of relevance"""
+    if not results or not results.get('metadatas'):
+        return []
+    sources = []
+    for metadata in results['metadatas'][0]:
+        source = str((metadata or {}).get(source_key, ''))
+        if source and source not in sources:
+            sources.append(source)
+    return sources
+
+def build_context(results, token_budget=1500, source_key='source', duplicate_threshold=0.9, model="gpt-3.5-turbo"):
+    """
+    Turns a chroma query result into prompt context: keeps only the text and its
+    source, merges overlapping chunks of the same source, drops near duplicates and
+    packs what is left by relevance into token_budget tokens.
+    """
+    if not results or not results.get('documents'):
+        return ""
+
+    chunks = []
+    for document, metadata, distance in zip(
+        results['documents'][0],
+        results.get('metadatas', [[]])[0] or [{}] * len(results['documents'][0]),
+        results.get('distances', [[]])[0] or [0.0] * len(results['documents'][0])
+    ):
+        if not document:
+            continue
+        metadata = metadata or {}
+        # chroma metadata can't hold None, a negative start_index means unknown
+        start = metadata.get('start_index')
+        chunks.append({
+            'text': document,
+            'source': str(metadata.get(source_key, '')),
+            'start': start if isinstance(start, int) and start >= 0 else None,
+            'distance': distance
+        })
+
+    by_source = {}
+    for chunk in chunks:
+        by_source.setdefault(chunk['source'], []).append(chunk)
+    chunks = [merged for source_chunks in by_source.values() for merged in _merge_source(source_chunks)]
+
+    # most relevant first, then drop anything that mostly repeats an earlier chunk
+    chunks.sort(key=lambda chunk: chunk['distance'])
+    kept = []
+    for chunk in chunks:
+        shingles = _shingles(chunk['text'])
+        duplicate = any(
+            len(shingles & other) / len(shingles | other) >= duplicate_threshold
+            for other in (k['shingles'] for k in kept)
+        )
+        if not duplicate:
+            kept.append(dict(chunk, shingles=shingles))
+
+    tokenizer = get_tokenizer(model)
+    separator = len(tokenizer.encode("\n\n"))
+    parts, used = [], 0
+    for chunk in kept:
+        part = f"[{chunk['source']}]\n{chunk['text']}" if chunk['source'] else chunk['text']
+        tokens = tokenizer.encode(part)
+        # parts after the first also pay for the separator joining them
+        cost = len(tokens) + (separator if parts else 0)
+        if used + cost > token_budget:
+            if not parts:
+                # the best chunk alone is over budget, keep its beginning and stop
+                parts.append(tokenizer.decode(tokens[:token_budget]))
+                break
+            continue
+        parts.append(part)
+        used += cost
+
+    return "\n\n".join(parts)
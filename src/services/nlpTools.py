@@ -25,11 +25,18 @@ nltk.download('wordnet')
 
 class TextProcessor:
     def __init__(self):
-        # Load spaCy language model
-        self.nlp = spacy.load("en_core_web_sm")
+        # spaCy is only needed for metadata extraction, it's loaded on first use
+        self._nlp = None
         self.lemmatizer = WordNetLemmatizer()
         self.stop_words = set(stopwords.words('english'))
 
+    @property
+    def nlp(self):
+        # Load spaCy language model
+        if self._nlp is None:
+            self._nlp = spacy.load("en_core_web_sm")
+        return self._nlp
+
     # --------- Preprocessing Functions --------- #
     def preprocess_text(self, text):
         # Tokenization
@@ -0,0 +1,26 @@
+# pdfChunker.py
+# Kept free of project imports so worker processes can import it cheaply
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import UnstructuredFileLoader
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+def load_and_split(path, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """
+    Parses one file and splits it into chunks. Returns plain dicts instead of
+    Documents so the result is cheap to pickle back from a worker process.
+    """
+    docs = UnstructuredFileLoader(path).load()
+
+    # start_index gives every chunk a stable offset in its file
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size = chunk_size,
+        chunk_overlap = chunk_overlap,
+        add_start_index = True
+    )
+
+    return [
+        {"page_content": doc.page_content, "metadata": doc.metadata}
+        for doc in text_splitter.split_documents(docs)
+    ]
@@ -0,0 +1,109 @@
+# profanityScorer.py
+import asyncio, logging
+from collections import OrderedDict
+from profanity_check import predict_prob
+
+class ProfanityScorer:
+    """
+    Profanity scores for messages. Lists are scored in one vectorized predict_prob call,
+    concurrent single messages are collected for `batch_window` seconds and scored together,
+    the model always runs in a worker thread and scores are memoized per message id.
+    """
+    def __init__(self, batch_window=0.005, max_batch=256, memo_size=10000):
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.memo_size = memo_size
+        self.memo = OrderedDict()   # message id -> score
+        self.pending = []           # (text, future) waiting for the next micro-batch
+        self._flush_handle = None
+        self._tasks = set()         # running batches, referenced until done so they aren't collected
+        self.scored = 0
+        self.batches = 0
+        self.memo_hits = 0
+
+    @staticmethod
+    def _predict(texts):
+        return [float(score) for score in predict_prob(texts)]
+
+    def _remember(self, message_id, score):
+        if message_id is None:
+            return
+        self.memo[message_id] = score
+        self.memo.move_to_end(message_id)
+        while len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+    def _recall(self, message_id):
+        if message_id is None or message_id not in self.memo:
+            return None
+        self.memo_hits += 1
+        self.memo.move_to_end(message_id)
+        return self.memo[message_id]
+
+    async def score(self, text, message_id=None):
+        """Score of one message, batched with the other messages arriving within batch_window"""
+        score = self._recall(message_id)
+        if score is not None:
+            return score
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future))
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+
+        score = await future
+        self._remember(message_id, score)
+        return score
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.ensure_future(self._score_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _score_batch(self, batch):
+        try:
+            scores = await asyncio.to_thread(self._predict, [text for text, _ in batch])
+        except Exception as e:
+            logging.error(f"Error with scoring profanity of {len(batch)} messages: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.scored += len(batch)
+        self.batches += 1
+        for (_, future), score in zip(batch, scores):
+            if not future.done():
+                future.set_result(score)
+
+    async def score_many(self, texts, message_ids=None):
+        """Scores of a list of messages in one vectorized call, memoized ones are not scored again"""
+        message_ids = list(message_ids) if message_ids is not None else [None] * len(texts)
+        scores = [self._recall(message_id) for message_id in message_ids]
+        missing = [i for i, score in enumerate(scores) if score is None]
+
+        if missing:
+            predicted = await asyncio.to_thread(self._predict, [texts[i] for i in missing])
+            self.scored += len(missing)
+            self.batches += 1
+            for i, score in zip(missing, predicted):
+                scores[i] = score
+                self._remember(message_ids[i], score)
+        return scores
+
+    def stats(self):
+        return {
+            "scored": self.scored,
+            "batches": self.batches,
+            "avg_batch": round(self.scored / self.batches, 2) if self.batches else 0.0,
+            "memo_hits": self.memo_hits,
+            "memoized": len(self.memo),
+        }
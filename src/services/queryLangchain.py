@@ -1,21 +1,189 @@
-import os, asyncio
-from openai import OpenAI
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain.chains import RetrievalQA
+import os, asyncio, logging, random, time
+import httpx
+import openai
+from collections import OrderedDict
+from openai import AsyncOpenAI
 from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings.sentence_transformer import SentenceTransformerEmbeddings
 
-from utlis.config import OPENAI_API_KEY, DB_PATH, DISTANCE_THRESHOLD
+from utlis.config import (
+    OPENAI_API_KEY, DB_PATH, DISTANCE_THRESHOLD,
+    LLM_MAX_IN_FLIGHT, LLM_MAX_RETRIES, LLM_TIMEOUT
+)
+from database.modelsChroma import embedding_registry
+
+class LLMGateway:
+    """
+    Single async entry point to the OpenAI chat API. Shares one pooled HTTP
+    connection, caps the requests in flight, retries 429/5xx with jittered
+    exponential backoff and keeps latency and token counts.
+    """
+    def __init__(self, api_key, model="gpt-3.5-turbo", max_in_flight=8, max_retries=4, timeout=30.0):
+        self.model = model
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_in_flight * 2, max_keepalive_connections=max_in_flight),
+            timeout=timeout
+        )
+        # retries are handled here so they also respect the semaphore
+        self.client = AsyncOpenAI(api_key=api_key, http_client=self.http_client, max_retries=0)
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.stats = {
+            "calls": 0, "errors": 0, "retries": 0, "latency_s": 0.0,
+            "prompt_tokens": 0, "completion_tokens": 0
+        }
+
+    @staticmethod
+    def _retryable(error):
+        if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+    async def _backoff(self, attempt, error):
+        # full jitter: sleep somewhere between 0 and 0.5s * 2^attempt, capped at 8s
+        delay = random.uniform(0, min(8.0, 0.5 * 2 ** attempt))
+        self.stats["retries"] += 1
+        logging.warning(f"LLM call failed ({error}), retrying in {delay:.2f}s")
+        await asyncio.sleep(delay)
+
+    def _record(self, start, usage):
+        self.stats["calls"] += 1
+        self.stats["latency_s"] += time.perf_counter() - start
+        if usage:
+            self.stats["prompt_tokens"] += usage.prompt_tokens
+            self.stats["completion_tokens"] += usage.completion_tokens
+
+    async def chat(self, messages, temperature=0, max_tokens=500):
+        async with self.semaphore:
+            start = time.perf_counter()
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        timeout=self.timeout,
+                    )
+                    self._record(start, response.usage)
+                    return response.choices[0].message.content
+
+                except Exception as e:
+                    if attempt == self.max_retries or not self._retryable(e):
+                        self.stats["errors"] += 1
+                        raise
+                    await self._backoff(attempt, e)
+
+    async def stream(self, messages, temperature=0, max_tokens=500):
+        """Yields the completion token by token, retrying only until the first token arrived"""
+        async with self.semaphore:
+            start = time.perf_counter()
+            for attempt in range(self.max_retries + 1):
+                started = False
+                try:
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        timeout=self.timeout,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                    )
+                    usage = None
+                    async for chunk in response:
+                        if chunk.usage:
+                            usage = chunk.usage
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            started = True
+                            yield chunk.choices[0].delta.content
+                    self._record(start, usage)
+                    return
 
-llm = ChatOpenAI(
-    temperature=0,
-    model_name="gpt-3.5-turbo",
-    max_tokens=500,
-    openai_api_key=OPENAI_API_KEY
+                except Exception as e:
+                    if started or attempt == self.max_retries or not self._retryable(e):
+                        self.stats["errors"] += 1
+                        raise
+                    await self._backoff(attempt, e)
+
+    def get_stats(self):
+        calls = self.stats["calls"]
+        return dict(self.stats, avg_latency_s=round(self.stats["latency_s"] / calls, 3) if calls else 0.0)
+
+    async def aclose(self):
+        await self.http_client.aclose()
+
+llm_gateway = LLMGateway(
+    OPENAI_API_KEY,
+    max_in_flight=LLM_MAX_IN_FLIGHT,
+    max_retries=LLM_MAX_RETRIES,
+    timeout=LLM_TIMEOUT
 )
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+class RetrieverCache:
+    """
+    Keeps the langchain vector store and retriever for each (collection, top_k, threshold)
+    so they are built once instead of per request. Entries of a collection are dropped
+    whenever that collection is written to.
+    """
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.chroma_client = None
+
+    def attach(self, crud):
+        # share the CRUD chroma client instead of opening the persist directory again
+        self.chroma_client = crud.client
+        crud.add_write_listener(self.on_write)
+
+    def on_write(self, collection_name, event):
+        self.invalidate(collection_name)
+
+    def invalidate(self, collection_name):
+        for key in [key for key in self.entries if key[0] == str(collection_name)]:
+            del self.entries[key]
+
+    def get(self, collection_name, top_k, score_threshold):
+        key = (str(collection_name), top_k, score_threshold)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        if self.chroma_client is not None:
+            vectorstore = Chroma(
+                client=self.chroma_client,
+                embedding_function=embedding_registry.get(),
+                collection_name=key[0]
+            )
+        else:
+            vectorstore = Chroma(
+                embedding_function=embedding_registry.get(),
+                persist_directory=DB_PATH, 
+                collection_name=key[0]
+            )
+
+        retriever = vectorstore.as_retriever(
+            search_type="similarity_score_threshold", 
+            search_kwargs={"k": top_k, "score_threshold": score_threshold}
+        )
+        self.entries[key] = retriever
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return retriever
+
+retriever_cache = RetrieverCache()
+
+# Default prompt of the langchain "stuff" chain used by fetchLangchainResponse
+STUFF_PROMPT = """Use the following pieces of context to answer the question at the end. If you don't know the answer, just say that you don't know, don't try to make up an answer.
+
+{context}
+
+Question: {question}
+Helpful Answer:"""
+
+QUESTION_TEMPLATE = """
+        Respond as clearly as possible with more than 100 words {query}?
+        """
 
 '''
 Here, three different versions of the fetchGptResponse function are defined.
@@ -23,68 +191,53 @@ From the average of testing the time taken for each version, here are the averag
 fetchLangchainResponse: 2.840806246	
 fetchGptResponseTwo: 4.176655531	
 fetchGptResponse: 3.762374473
+Run src/benchmarks/benchLatency.py for reproducible p50/p95/p99 numbers against a local fake OpenAI server.
 '''
 
 
 async def fetchGptResponse(query, role, data=[]):
-    response = await asyncio.to_thread(
-        llm.invoke,
-        [
-            ("system", f"{role} Here are the relevant information {str(data)}."),
-            ("user", query)
-        ]
-    )
-    return response.content
-
+    return await llm_gateway.chat([
+        {"role": "system", "content": f"{role} Here are the relevant information {str(data)}."},
+        {"role": "user", "content": query}
+    ])
 
-async def fetchLangchainResponse(query, collection_name, top_k=10):
 
-    embedding_model = OpenAIEmbeddings(model="text-embedding-ada-002")
-    # embedding_model = SentenceTransformerEmbeddings(model="all-MiniLM-L6-v2")
+async def fetchGptResponseStream(query, role, data=[]):
+    """Same as fetchGptResponse, but yields the answer token by token as it is generated"""
+    async for token in llm_gateway.stream([
+        {"role": "system", "content": f"{role} Here are the relevant information {str(data)}."},
+        {"role": "user", "content": query}
+    ]):
+        yield token
 
-    # Initialize the ChromaDB client and retriever
-    client = Chroma(
-        embedding_function=embedding_model,
-        persist_directory=DB_PATH, 
-        collection_name=str(collection_name)
-    )
 
+async def fetchLangchainResponse(query, collection_name, top_k=10):
     try:
-        # Initialize the RetrievalQA chain
-        chatbot_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=client.as_retriever(
-                search_type="similarity_score_threshold", 
-                search_kwargs={"k": top_k, "score_threshold": DISTANCE_THRESHOLD}
-            ),
-            verbose=True, 
-            return_source_documents=True,
-        )
+        # the vector store and retriever are built once per collection and settings
+        retriever = retriever_cache.get(collection_name, top_k, DISTANCE_THRESHOLD)
 
-        # Define the prompt template
-        template = f"""
-        Respond as clearly as possible with more than 100 words {query}?
-        """
+        question = QUESTION_TEMPLATE.format(query=query)
 
-        prompt = PromptTemplate(
-            input_variables=["query"],
-            template=template,
-        )
-
-        # Run the query through the chatbot chain
-        response = chatbot_chain.invoke(prompt.format(query=query))
+        # Retrieve the documents and "stuff" them into the prompt, like a RetrievalQA chain
+        source_documents = await retriever.ainvoke(question)
+        context = "\n\n".join(doc.page_content for doc in source_documents)
+        result = await llm_gateway.chat([
+            {"role": "user", "content": STUFF_PROMPT.format(context=context, question=question)}
+        ])
 
         # Extract and print source documents
-        source_documents = response.get('source_documents', [])
         sources = [doc.metadata['source'] for doc in source_documents]
         sources = list(set(sources))
-        response["sources"] = sources
 
-        return response
+        return {
+            "query": question,
+            "result": result,
+            "source_documents": source_documents,
+            "sources": sources
+        }
 
     except Exception as e:
-        print(f"Error with fetching Langchain response: {e}")
+        logging.error(f"Error with fetching Langchain response: {e}")
         return "I'm sorry, I couldn't find an answer to that question."
 
 
@@ -96,17 +249,9 @@ async def fetchGptResponseTwo(query, role, data=[]):
     ]
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            temperature=0,
-            max_tokens=500,
-        )
-
-        print(f"Response from OpenAI: {response}")
-        assistant_reply = response.choices[0].message.content
+        assistant_reply = await llm_gateway.chat(messages)
         return assistant_reply
     
     except Exception as e:
-        print(f"Error with fetching GPT response: {e}")
+        logging.error(f"Error with fetching GPT response: {e}")
         return "I'm sorry, I couldn't find an answer to that question."
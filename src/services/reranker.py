@@ -0,0 +1,94 @@
+# reranker.py
+import asyncio, logging, math, threading, time
+
+from utlis.processMemory import current_rss_mb, rss_delta_mb
+from utlis.config import RERANK_MODEL, RERANK_MIN_SCORE, RERANK_MIN_CHUNKS, RERANK_MAX_CHUNKS
+
+class Reranker:
+    """
+    Optional cross-encoder stage between retrieval and the LLM call. All (query, chunk)
+    pairs are scored in one batched forward pass and only the best few chunks are kept,
+    which trades a few ms of CPU for a smaller prompt and a faster completion.
+    """
+    def __init__(self, model_name=RERANK_MODEL, min_score=RERANK_MIN_SCORE, min_chunks=RERANK_MIN_CHUNKS, max_chunks=RERANK_MAX_CHUNKS):
+        self.model_name = model_name
+        self.min_score = min_score
+        self.min_chunks = min_chunks
+        self.max_chunks = max_chunks
+        self._model = None
+        self._lock = threading.Lock()
+        self._stats = {"reranked": 0, "candidates": 0, "kept": 0, "rerank_time_s": 0.0}
+
+    @property
+    def enabled(self):
+        return bool(self.model_name)
+
+    def get_model(self):
+        if self._model is None:
+            # loaded once, requests may come from several worker threads
+            with self._lock:
+                if self._model is None:
+                    # sentence-transformers is only needed when reranking is enabled
+                    from sentence_transformers import CrossEncoder
+
+                    rss_before = current_rss_mb()
+                    start = time.perf_counter()
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+                    self._stats["load_time_s"] = round(time.perf_counter() - start, 3)
+                    self._stats["memory_mb"] = rss_delta_mb(rss_before, current_rss_mb())
+                    logging.info(f"Loaded rerank model {self.model_name} in {self._stats['load_time_s']}s")
+        return self._model
+
+    async def warm_up(self):
+        if self.enabled:
+            await asyncio.to_thread(self.get_model)
+
+    def score(self, query, documents):
+        """Relevance probabilities of documents for query, one batched forward pass"""
+        model = self.get_model()
+        logits = model.predict([(query, document) for document in documents], batch_size=len(documents), show_progress_bar=False)
+        # ms-marco cross-encoders output logits, a sigmoid maps them to a calibrated 0..1 score
+        return [1 / (1 + math.exp(-float(logit))) for logit in logits]
+
+    def cutoff(self, scores):
+        """Indices to keep: best first, above min_score, between min_chunks and max_chunks of them"""
+        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:self.max_chunks]
+        kept = [i for i in ranked if scores[i] >= self.min_score]
+        return kept if len(kept) >= self.min_chunks else ranked[:self.min_chunks]
+
+    async def rerank(self, query, results):
+        """Reranks a chroma query result, returns the same nested layout with distance = 1 - score"""
+        if not self.enabled or not results or not results.get('documents') or not results['documents'][0]:
+            return results
+
+        documents = results['documents'][0]
+        start = time.perf_counter()
+        try:
+            scores = await asyncio.to_thread(self.score, query, [document or "" for document in documents])
+        except Exception as e:
+            # the retrieval order is still usable without the reranker
+            logging.error(f"Error with reranking, keeping the retrieval order: {e}")
+            return results
+
+        kept = self.cutoff(scores)
+        elapsed = time.perf_counter() - start
+        self._stats["reranked"] += 1
+        self._stats["candidates"] += len(documents)
+        self._stats["kept"] += len(kept)
+        self._stats["rerank_time_s"] += elapsed
+        logging.info(f"Reranked {len(documents)} chunks in {elapsed * 1000:.1f}ms, kept {len(kept)}")
+
+        reranked = {'distances': [[1 - scores[i] for i in kept]]}
+        for key in ('ids', 'documents', 'metadatas'):
+            if results.get(key):
+                reranked[key] = [[results[key][0][i] for i in kept]]
+        return reranked
+
+    def stats(self):
+        stats = dict(self._stats, model=self.model_name or None)
+        if self._stats["reranked"]:
+            stats["avg_kept"] = round(self._stats["kept"] / self._stats["reranked"], 2)
+            stats["avg_rerank_ms"] = round(self._stats["rerank_time_s"] / self._stats["reranked"] * 1000, 2)
+        return stats
+
+reranker = Reranker()
@@ -0,0 +1,155 @@
+# semanticCache.py
+import logging, time
+import numpy as np
+from collections import OrderedDict
+
+class SemanticCache:
+    """
+    Caches answers and their sources by query embedding. A query within `threshold` cosine
+    similarity of a cached query on the same collection (and collection version) reuses its answer.
+    Chat history collections get a new message on nearly every query, so their answers aren't
+    tied to the collection version and only expire after `chat_ttl` seconds (or on deletes).
+    """
+    def __init__(self, crud, threshold=0.95, ttl=3600, max_entries=1000, chat_ttl=300, chat_prefix="chat_history_"):
+        self.crud = crud
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.chat_ttl = chat_ttl
+        self.chat_prefix = chat_prefix
+
+        # entry id -> entry, ordered from least to most recently used
+        self.entries = OrderedDict()
+        self.next_id = 0
+        self.matrices = {}  # collection -> (entry ids, stacked normalized embeddings)
+        self.hits = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+
+        crud.add_write_listener(self.on_write)
+
+    def is_chat(self, collection_name):
+        return collection_name.startswith(self.chat_prefix)
+
+    def on_write(self, collection_name, event):
+        # new messages don't invalidate chat answers, they age out with chat_ttl instead
+        if self.is_chat(collection_name) and event.get('op') == 'upsert':
+            return
+        self.invalidate(collection_name)
+
+    def invalidate(self, collection_name):
+        stale = [id for id, entry in self.entries.items() if entry['collection'] == collection_name]
+        for id in stale:
+            del self.entries[id]
+        self.matrices.pop(collection_name, None)
+        if stale:
+            logging.info(f"Invalidated {len(stale)} cached answers for {collection_name}")
+
+    def _matrix(self, collection_name):
+        if collection_name not in self.matrices:
+            ids = [id for id, entry in self.entries.items() if entry['collection'] == collection_name]
+            vectors = np.stack([self.entries[id]['embedding'] for id in ids]) if ids else None
+            self.matrices[collection_name] = (ids, vectors)
+        return self.matrices[collection_name]
+
+    def _remove(self, id):
+        entry = self.entries.pop(id)
+        self.matrices.pop(entry['collection'], None)
+
+    def get(self, collection_name, query_embedding):
+        ids, vectors = self._matrix(collection_name)
+        if not ids:
+            return None
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        similarities = vectors @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+
+        id = ids[best]
+        entry = self.entries[id]
+        if self.is_chat(collection_name):
+            stale = time.time() - entry['created'] > self.chat_ttl
+        else:
+            stale = time.time() - entry['created'] > self.ttl or entry['version'] != self.crud.collection_version(collection_name)
+        if stale:
+            self._remove(id)
+            return None
+
+        self.entries.move_to_end(id)
+        return entry
+
+    def put(self, collection_name, query_embedding, answer, latency, version, sources=None):
+        vector = np.asarray(query_embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+
+        self.entries[self.next_id] = {
+            'collection': collection_name,
+            'embedding': vector,
+            'answer': answer,
+            'sources': list(sources or []),
+            'version': version,
+            'created': time.time(),
+            'latency': latency,
+        }
+        self.next_id += 1
+        self.matrices.pop(collection_name, None)
+
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+
+    def _lookup(self, collection_name, query_embedding):
+        entry = self.get(collection_name, query_embedding)
+        if entry is not None:
+            self.hits += 1
+            self.saved_latency += entry['latency']
+            logging.info(f"Answer cache hit for {collection_name}")
+        else:
+            self.misses += 1
+        return entry
+
+    async def get_or_compute(self, collection_name, query_embedding, compute):
+        """
+        Returns {'answer', 'sources'} of a similar cached query, otherwise awaits compute()
+        (which returns the same dict) and caches it
+        """
+        entry = self._lookup(collection_name, query_embedding)
+        if entry is not None:
+            return {'answer': entry['answer'], 'sources': entry['sources']}
+
+        # remember the version before computing so a concurrent write makes the entry stale
+        version = self.crud.collection_version(collection_name)
+        start = time.perf_counter()
+        result = await compute()
+        self.put(collection_name, query_embedding, result['answer'], time.perf_counter() - start, version, result.get('sources'))
+        return result
+
+    async def stream_or_compute(self, collection_name, query_embedding, compute_stream):
+        """
+        Streaming variant of get_or_compute, the answer is cached once the stream completes.
+        compute_stream(sources) yields the answer tokens and fills the sources list.
+        """
+        entry = self._lookup(collection_name, query_embedding)
+        if entry is not None:
+            yield entry['answer']
+            return
+
+        version = self.crud.collection_version(collection_name)
+        start = time.perf_counter()
+        tokens, sources = [], []
+        async for token in compute_stream(sources):
+            tokens.append(token)
+            yield token
+        self.put(collection_name, query_embedding, ''.join(tokens), time.perf_counter() - start, version, sources)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "saved_latency_s": round(self.saved_latency, 3),
+            "entries": len(self.entries),
+        }
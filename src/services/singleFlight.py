@@ -0,0 +1,92 @@
+# singleFlight.py
+import asyncio
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+class SharedStream:
+    """Tokens of one in-flight stream, buffered so late subscribers can replay them"""
+    def __init__(self):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Condition()
+        self.task = None
+
+class SingleFlight:
+    """Coalesces identical concurrent calls: duplicates await the call already in flight"""
+    def __init__(self):
+        self.in_flight = {}
+        self.streams = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key, compute):
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(compute())
+        self.in_flight[key] = task
+        self.leaders += 1
+
+        def done(_):
+            if self.in_flight.get(key) is task:
+                del self.in_flight[key]
+        task.add_done_callback(done)
+
+        # shielded so the shared call survives the first caller disconnecting
+        return await asyncio.shield(task)
+
+    async def stream(self, key, compute_stream):
+        """
+        Streaming variant of run: the first caller starts compute_stream() in a task that fills
+        a shared token buffer, duplicates replay the tokens produced so far and then follow it
+        """
+        shared = self.streams.get(key)
+        if shared is not None:
+            self.coalesced += 1
+        else:
+            shared = SharedStream()
+            self.streams[key] = shared
+            self.leaders += 1
+            # a task, so the shared stream survives the first caller disconnecting
+            shared.task = asyncio.ensure_future(self._produce(key, shared, compute_stream))
+
+        i = 0
+        while True:
+            async with shared.changed:
+                await shared.changed.wait_for(lambda: i < len(shared.tokens) or shared.done)
+                tokens = shared.tokens[i:]
+            for token in tokens:
+                yield token
+            i += len(tokens)
+            if shared.done and i == len(shared.tokens):
+                if shared.error is not None:
+                    raise shared.error
+                return
+
+    async def _produce(self, key, shared, compute_stream):
+        try:
+            async for token in compute_stream():
+                async with shared.changed:
+                    shared.tokens.append(token)
+                    shared.changed.notify_all()
+        except Exception as e:
+            shared.error = e
+        finally:
+            if self.streams.get(key) is shared:
+                del self.streams[key]
+            async with shared.changed:
+                shared.done = True
+                shared.changed.notify_all()
+
+    def stats(self):
+        total = self.leaders + self.coalesced
+        return {
+            "computed": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesce_rate": round(self.coalesced / total, 3) if total else 0.0,
+            "in_flight": len(self.in_flight) + len(self.streams),
+        }
@@ -22,4 +22,45 @@ if not PROFANITY_THRESHOLD:
     raise ValueError("PROFANITY_THRESHOLD is not set in .env file")
 
 if not DISTANCE_THRESHOLD:
-    raise ValueError("DISTANCE_THRESHOLD is not set in .env file")
\ No newline at end of file
+    raise ValueError("DISTANCE_THRESHOLD is not set in .env file")
+
+# Optional tuning parameters, defaults are used when not set in .env
+EMBEDDING_OPTION = os.getenv("EMBEDDING_OPTION", "openai")                  # "openai" or "sentence-transformer"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 512))          # max texts per embedding request
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", 50000))    # max (estimated) tokens per embedding request
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", 4))          # embedding requests in flight at once
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 10000))        # embeddings kept in memory
+EMBEDDING_CACHE_DISK_SIZE = int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", 500000))  # embeddings kept on disk
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "embedding_cache.sqlite3")
+)
+CHROMA_UPSERT_BATCH_SIZE = int(os.getenv("CHROMA_UPSERT_BATCH_SIZE", 1000))  # max documents per chroma upsert
+CHROMA_MAX_WORKERS = int(os.getenv("CHROMA_MAX_WORKERS", 4))                # threads serving chroma reads and writes
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 64))                 # chunks embedded and upserted together
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 4))                  # max batches waiting between stages
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", min(4, (os.cpu_count() or 1) // 2)))  # processes parsing PDFs, 0 or 1 parses in a thread
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))    # min cosine similarity to reuse an answer
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 3600))                 # seconds a cached answer stays valid
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1000))               # max cached answers
+ANSWER_CACHE_CHAT_TTL = int(os.getenv("ANSWER_CACHE_CHAT_TTL", 300))        # seconds a cached chat history answer stays valid
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.0))        # min seconds between streamed discord edits
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", 8))                  # concurrent chat completion requests
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 4))                      # retries on 429/5xx/timeouts
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 30.0))                         # seconds per chat completion attempt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))         # max prompt tokens of retrieved context
+LEXICAL_FASTPATH_MAX_TOKENS = int(os.getenv("LEXICAL_FASTPATH_MAX_TOKENS", 6))  # max query terms for BM25-only retrieval, 0 disables it
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")                                # cross-encoder, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2 (needs sentence-transformers), empty disables reranking
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 10))                 # chunks retrieved for the reranker to choose from
+RERANK_MIN_SCORE = float(os.getenv("RERANK_MIN_SCORE", 0.5))                # min reranker probability for a chunk to reach the prompt
+RERANK_MIN_CHUNKS = int(os.getenv("RERANK_MIN_CHUNKS", 2))                  # chunks kept even when below RERANK_MIN_SCORE
+RERANK_MAX_CHUNKS = int(os.getenv("RERANK_MAX_CHUNKS", 3))                  # max chunks kept after reranking
+ROUTE_SCORE_THRESHOLD = float(os.getenv("ROUTE_SCORE_THRESHOLD", 0.82))     # min cosine similarity to pick a route, below falls back
+ROUTE_INDEX_PATH = os.getenv(                                               # persisted utterance embeddings (.npy + .json)
+    "ROUTE_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "route_index")
+)
+ROUTE_FANOUT_MARGIN = float(os.getenv("ROUTE_FANOUT_MARGIN", 0.02))         # top two route scores closer than this retrieve from several experts
+ROUTE_FANOUT_TOP_N = int(os.getenv("ROUTE_FANOUT_TOP_N", 2))                # max experts retrieved from when fanning out
+PROFANITY_BATCH_WINDOW = float(os.getenv("PROFANITY_BATCH_WINDOW", 0.005))  # seconds live messages are collected into one scoring batch
+PROFANITY_MEMO_SIZE = int(os.getenv("PROFANITY_MEMO_SIZE", 10000))          # message scores remembered by message id
@@ -0,0 +1,17 @@
+# processMemory.py
+import os
+
+def current_rss_mb():
+    """Resident set size of this process right now in MB, None where /proc isn't available"""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+def rss_delta_mb(before, after):
+    """Memory added between two current_rss_mb() readings, None if either is unknown"""
+    if before is None or after is None:
+        return None
+    return round(after - before, 1)